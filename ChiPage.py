@@ -1,6 +1,19 @@
 from DefaultWindow import DefaultWindow
+from histogram import Histogram
+from ProfileOverlay import ProfileOverlay
+from profiling import profiler, timed
+from sketch import QuantileSketch
+from TableGrid import TableGrid
+from worker import BatchWorker, ImportWorker
+import distcache
+import engine
+import export
+import loader
+import parallel
+import session
 
 import tkinter as tk
+from tkinter import ttk
 
 import matplotlib
 matplotlib.use("TkAgg")
@@ -9,18 +22,30 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib import pyplot as plt
 
 import numpy as np
-import pandas as pd
-from scipy import stats as scstats
 
-import random
 import os
 import math
-from collections import Counter
-import pickle
 
 
 # NOTE - USE GLOBAL VARIABLES ONLY FOR FUNCTIONS, UI ELEMENTS AND THOSE DEFINED IN INIT
 
+# Largest number of rows or columns of an input table
+MAX_TABLE_SIZE = 100
+
+# Sample size of imported raw data when none is typed in
+DEFAULT_SAMPLE_SIZE = 100
+
+# Most individuals shown on the run once grid, about one per pixel of the graph.
+# Bigger tables are scaled down to this many, keeping each cell's share
+MAX_GRID_CELLS = 160000
+
+# Background runs - batches per redraw and queue polling interval
+REDRAW_EVERY = 5
+POLL_MS = 50
+
+# Significance levels whose simulated critical values are shown, the middle one is marked on the graph
+CRITICAL_LEVELS = (0.9, 0.95, 0.99)
+
 class ChiPage(DefaultWindow):
     '''ChiPage class for the Chi Square simulation'''
 
@@ -46,18 +71,46 @@ class ChiPage(DefaultWindow):
         self.sample_size = None
         self.data_values = None
         self.dof = None
-        self.default_table = None
         self.default_sample = None
 
         # Instantiate variables - graph
         self.nearest_square = None
+        self.grid_counts = None
         self.data = None
-        self.data2 = None
+        self.histogram = None
+        self.sketch = None
         self.line_shown = False
 
         # Instantiate variables - animation
         self.cycle_count = None
         self.total_runs = None
+        self.reveal = None
+        self.background = None
+        self.replicate = None
+        self.replaying = False
+        self.sample = None
+
+        # Instantiate variables - simulation
+        self.stream = parallel.SeededStream()
+        distcache.warm_in_background()
+        self.worker = None
+        self.batches_drawn = None
+        self.next_replicate = None
+
+        # Instantiate variables - fixed margin mode
+        self.fixed_margins = False
+        self.observed = None
+        self.exceeding = None
+
+        # Instantiate variables - saved session, which new replicates are added to
+        self.session = None
+
+        # Instantiate variables - file replicates are exported to, finished when the window closes
+        self.exporter = export.ExportControl()
+        self.frame.bind('<Destroy>', self.exporter.close)
+
+        # Timings overlay, shown with F12
+        self.overlay = ProfileOverlay(self)
 
 
     def _input_chosen(self):
@@ -66,32 +119,30 @@ class ChiPage(DefaultWindow):
         self.button_frame.destroy()
 
         # Add instruction label
-        self.inst = tk.Label(self.frame, text = 'Input a table below, with a 2x2 or bigger table', height = 2, fg = self.fg_color, bg = self.bg_color, font = self.normal_font)
+        self.inst = tk.Label(self.frame, text = 'Input a table below, with titles in the first row and column', height = 2, fg = self.fg_color, bg = self.bg_color, font = self.normal_font)
         self.inst.pack()
 
-        # Input table
-        self.table_frame = tk.Frame(self.frame, bg = self.bg_color, highlightbackground = self.fg_color, highlightthickness = 1)
-        self.default_table = True
-        self.default_sample = True
+        # Table size
+        self.size_frame = tk.Frame(self.frame, bg = self.bg_color)
 
-        self.entries = [[] for i in range(4)]
-        for row in range(4):
-            for col in range(4):
-                if row == 0 and col == 0:
-                    pass
-                elif row == 0 or col == 0:
-                    entry = tk.Entry(self.table_frame, bg = self.bg_color, font = self.normal_font)
-                    entry.insert(tk.END, 'Title')
-                    entry.bind("<Button-1>", self._clear_instructions)
-                    entry.grid(row = row, column = col)
-                    self.entries[row].append(entry)
-                else:
-                    entry = tk.Entry(self.table_frame, bg = self.bg_color, font = self.normal_light_font)
-                    entry.bind("<Button-1>", self._clear_instructions)
-                    entry.grid(row = row, column = col)
-                    self.entries[row].append(entry)
-
-        self.table_frame.pack(padx = 20, pady = 20)
+        tk.Label(self.size_frame, text = 'Rows', bg = self.bg_color, fg = self.fg_color, font = self.normal_light_font).pack(side = 'left')
+        self.rows_spin = tk.Spinbox(self.size_frame, from_ = 2, to = MAX_TABLE_SIZE, width = 4, font = self.normal_light_font, command = self._resize_table)
+        self.rows_spin.pack(side = 'left', padx = (10, 30))
+
+        tk.Label(self.size_frame, text = 'Columns', bg = self.bg_color, fg = self.fg_color, font = self.normal_light_font).pack(side = 'left')
+        self.cols_spin = tk.Spinbox(self.size_frame, from_ = 2, to = MAX_TABLE_SIZE, width = 4, font = self.normal_light_font, command = self._resize_table)
+        self.cols_spin.pack(side = 'left', padx = 10)
+
+        for spin in (self.rows_spin, self.cols_spin):
+            spin.bind("<Return>", lambda event: self._resize_table())
+            spin.bind("<FocusOut>", lambda event: self._resize_table())
+
+        self.size_frame.pack()
+
+        # Input table, drawn on a canvas so big tables stay quick
+        self.default_sample = True
+        self.table = TableGrid(self.frame, np.full((3, 3), '', dtype = object), self.bg_color, self.fg_color, self.normal_light_font, self.normal_font, editable = True)
+        self.table.frame.pack(padx = 20, pady = 20)
 
         # Sample size
         self.sample_entry = tk.Entry(self.frame, bg = self.bg_color, font = self.normal_light_font)
@@ -111,10 +162,15 @@ class ChiPage(DefaultWindow):
 
         files_button_frame = tk.Frame(self.files_frame, bg = self.bg_color, padx = 20, pady = 20, width = 40)
         
-        tk.Button(files_button_frame, text = 'Import file', height = 2, width = 10, font = self.normal_font, command = self._import_chosen, padx = 20).pack(side = 'left', padx = 10)
-        tk.Button(files_button_frame, text = 'Export file', height = 2, width = 10, font = self.normal_font, command = self._export_chosen, padx = 20).pack(side = 'right', padx = 10)
+        tk.Button(files_button_frame, text = 'Open session', height = 2, width = 10, font = self.normal_font, command = self._import_chosen, padx = 20).pack(side = 'left', padx = 10)
+        tk.Button(files_button_frame, text = 'Import CSV', height = 2, width = 10, font = self.normal_font, command = self._import_csv, padx = 20).pack(side = 'left', padx = 10)
+        tk.Button(files_button_frame, text = 'Save session', height = 2, width = 10, font = self.normal_font, command = self._export_chosen, padx = 20).pack(side = 'right', padx = 10)
 
         files_button_frame.pack(side = 'bottom', padx = 20)
+        self.files_button_frame = files_button_frame
+
+        # Shown while a CSV file is read, outside the buttons disabled meanwhile
+        self.button_cancel_import = tk.Button(self.files_frame, text = 'Cancel', height = 2, width = 10, font = self.normal_font, command = lambda: self.worker.cancel(), padx = 20)
 
         self.files_frame.pack(side = 'bottom', fill = tk.BOTH, expand = True)
 
@@ -123,36 +179,121 @@ class ChiPage(DefaultWindow):
         
         try:
 
-            # Get files
-            file_name = tk.filedialog.askopenfilename(initialdir = os.path.join("/Users", os.environ["USER"], "Desktop", "save.stat"), filetypes = (("Stat Files", "*.stat"),))
+            # Get files, saving old .stat files as sessions the first time they're opened
+            file_name = tk.filedialog.askopenfilename(initialdir = os.path.expanduser("~"), filetypes = (("Session Files", "*.session"), ("Stat Files", "*.stat")))
             if not file_name:
                 return False
-            self.data_values, self.sample_size = pickle.load(open(file_name, "rb"))
+            if file_name.endswith('.stat'):
+                self.session = session.migrate(file_name)
+            else:
+                self.session = session.Session.open(file_name)
+
+            # Carry on the saved generator, so new runs follow on from the saved ones
+            header = self.session.header
+            self.data_values = session.table_from_header(header)
+            self.sample_size = header['sample_size']
+            if header['seed'] is not None:
+                self.stream = parallel.SeededStream(header['seed'], header['spawned'], header.get('replicates', 0), header.get('samplers'))
             
-            # Discard elements
-            self.table_frame.destroy()
-            self.button_go.destroy()
-            self.sample_entry.destroy()
-            self.inst.destroy()
-            self.files_frame.destroy()
+            self._discard_input()
             
             # Generate simulation page
             self._simulation_page()
+            self._restore(header)
             
         except Exception as e:
+            self.session = None
             self.label_status['text'] = 'Error'
 
 
+    def _import_csv(self):
+
+        # Raw data has a row per individual, with their category in each of the first two columns
+        file_name = tk.filedialog.askopenfilename(initialdir = os.path.expanduser("~"), filetypes = (("CSV Files", "*.csv"),))
+        if not file_name:
+            return False
+        try:
+            self.worker = ImportWorker(self._read_csv(file_name), file_name)
+        except OSError:
+            self.label_status['text'] = 'Error: file could not be read'
+            return False
+
+        # Count the table on a background worker, keeping the input screen until it's ready
+        self._set_input_state(tk.DISABLED)
+        self.button_cancel_import.pack(side = 'bottom')
+        self.label_status['text'] = 'Reading file...'
+        self.worker.watch(self.label_status, POLL_MS, lambda text: self.label_status.config(text = text),
+                          lambda counter, message: self._import_finished(file_name, counter, message))
+
+
+    def _read_csv(self, file_name):
+        with profiler.phase('read csv'):
+            yield from loader.iter_contingency(file_name, max_categories = MAX_TABLE_SIZE)
+
+
+    def _import_finished(self, file_name, counter, message):
+
+        # Back to the input screen unless the file was read in full
+        self.worker = None
+        self.button_cancel_import.pack_forget()
+        self._set_input_state(tk.NORMAL)
+        if counter is None:
+            self.label_status['text'] = message
+            return
+        self._imported_csv(file_name, counter)
+
+
+    def _set_input_state(self, state):
+        self.button_go['state'] = state
+        for button in self.files_button_frame.winfo_children():
+            button['state'] = state
+
+
+    @timed('chi import')
+    def _imported_csv(self, file_name, counter):
+        counts, rows, cols = counter.table()
+
+        # Totals are added to the table under their own titles
+        if 'Total' in rows or 'Total' in cols:
+            self.label_status['text'] = 'Invalid, categories may not be called Total'
+            return False
+
+        # Sample size typed in, or the same as the random tables
+        if self.default_sample or not self.sample_entry.get().strip():
+            self.sample_size = DEFAULT_SAMPLE_SIZE
+            if counts.sum() < self.sample_size:
+                self.label_status['text'] = 'Invalid, sample size must be smaller than the number of data points'
+                return False
+        elif not self._check_sample_size(counts.sum()):
+            return False
+
+        self.data_values = self.make_df(counts.tolist(), rows, cols)
+        self._discard_input()
+        self._simulation_page()
+        skipped = f', skipped {counter.skipped:,} with a missing category' if counter.skipped else ''
+        self.chi_label['text'] = f'Counted {counts.sum():,} rows of {os.path.basename(file_name)}{skipped}'
+
+
+    def _discard_input(self):
+        self.table.destroy()
+        self.size_frame.destroy()
+        self.button_go.destroy()
+        self.sample_entry.destroy()
+        self.inst.destroy()
+        self.files_frame.destroy()
+
+
     def _export_chosen(self):
         self._input_run(export = True)
 
 
-    def _clear_instructions(self, event):
-        if self.default_table:
-            self.default_table = False
-            for i in self.entries:
-                for j in i:
-                    j.delete(0, tk.END)
+    def _resize_table(self):
+        try:
+            rows = min(max(int(self.rows_spin.get()), 2), MAX_TABLE_SIZE)
+            cols = min(max(int(self.cols_spin.get()), 2), MAX_TABLE_SIZE)
+        except ValueError:
+            return
+        self.table.resize(rows + 1, cols + 1)
 
 
     def _sample_clear(self, event):
@@ -163,82 +304,72 @@ class ChiPage(DefaultWindow):
 
     def _input_run(self, export = False):
         
-        # Read inputs from entries, saving in the values Np Array
-        values = [[] for i in range(4)]
-        values[0].append('_')
-        for entry_row_int, entry_row in enumerate(self.entries):
-            for entry in entry_row:
-                values[entry_row_int].append(entry.get().strip())
-        values = np.array(values)
-        
-        # Check if at least 2 rows and 2 columns are given, with titles
-        if not all(values[0:3, 0:3].flatten().tolist()):
-            self.label_status['text'] = 'Invalid, must have at least 2 rows and columns, with titles'
+        # Read the whole table, with titles in the first row and column
+        values = np.char.strip(self.table.get().astype(str))
+        rows = values[1:, 0]
+        cols = values[0, 1:]
+        titles = np.concatenate((rows, cols))
+        counts = values[1:, 1:]
+
+        # Check that every row and column has a title
+        if (np.char.str_len(titles) == 0).any():
+            self.label_status['text'] = 'Invalid, every row and column needs a title'
             return False
 
-        shape = [2, 2]
-        
-        # Check that if a third column / row is given it's full, with titles
-        if any(values[3].tolist()):
-            if not (values[3][0] and values[3][1] and values[3][2]):
-                self.label_status['text'] = 'Invalid, can\'t have a partial row'
-                return False
-            shape[0] = 3
-
-        if any(values[:, 3].tolist()):
-            if not (values[0][3] and values[1][3] and values[2][3]):
-                self.label_status['text'] = 'Invalid, can\'t have a partial column'
-                return False
-            shape[1] = 3
-
-        if any(values[3]) and any(values[:, 3].tolist()):
-            if not (values[3][3]):
-                self.label_status['text'] = 'Invalid, can\'t have a partial rows / colummns'
-                return False
+        # Check that no titles have numbers in them
+        if np.any([np.char.find(titles, digit) >= 0 for digit in '0123456789']):
+            self.label_status['text'] = 'Invalid, row and column titles may not have numbers in them'
+            return False
 
-        values[0, 0] = ''
-
-        # Check that all column titles are strings
-        for item in values[0][1:shape[0] + 1]:
-            for i in item:
-                if i.isdigit():
-                    self.label_status['text'] = 'Invalid, column titles may not have numbers in them'
-                    return False
-
-        # Check that all row titles are strings
-        for item in values.T[0][1:shape[0] + 1]:
-            for i in item:
-                if i.isdigit():
-                    self.label_status['text'] = 'Invalid, row titles may not have numbers in them'
-                    return False
-
-        # Check that all row and columns have unique names
-        names = list(values[0][1:shape[1] + 1]) + list(values.T[0][1:shape[0] + 1])
-        for i in range(len(names)):
-            names[i] = names[i].strip()
-        names = set(names)
-        if len(names) != sum(shape):
+        # Check that all row and columns have unique names, apart from the totals
+        if np.unique(titles).size != titles.size or (titles == 'Total').any():
             self.label_status['text'] = 'Invalid, row and column titles must all be unique'
             return False
 
-        # Check if all values are integers! 
+        # Check if all values are whole numbers
         try:
-            values_only = values[1:shape[0] + 1, 1:shape[1] + 1].astype(np.int)
-        except Exception:
-            self.label_status['text'] = 'Invalid, data values need to be integers'
+            if not np.char.isdigit(counts).all():
+                raise ValueError
+            values_only = counts.astype(np.int64)
+        except ValueError:
+            self.label_status['text'] = 'Invalid, data values need to be whole numbers'
             return False
 
         # Check for null rows
-        for row in values_only:
-            if not any(row):
-                self.label_status['text'] = 'Invalid, may not have null rows'
-                return False
+        if (values_only.sum(axis = 1) == 0).any():
+            self.label_status['text'] = 'Invalid, may not have null rows'
+            return False
 
         # Check for null columns
-        for col in values_only.T:
-            if not any(col):
-                self.label_status['text'] = 'Invalid, may not have null columns'
-                return False
+        if (values_only.sum(axis = 0) == 0).any():
+            self.label_status['text'] = 'Invalid, may not have null columns'
+            return False
+
+        if not self._check_sample_size(values_only.sum()):
+            return False
+            
+        # Generate data_values with the full list version of a pd df
+        self.data_values = self.make_df(values_only.tolist(), rows.tolist(), cols.tolist())
+
+        if not export:
+
+            self._discard_input()
+            
+            # Generate function
+            self._simulation_page()
+            
+        else:
+            try:
+                file_name = self._ask_session_file()
+                if file_name:
+                    session.Session.create(file_name, session.make_header(self.data_values, self.sample_size))
+            except Exception:
+                self.label_status['text'] = 'Error'
+
+
+    def _check_sample_size(self, total):
+        '''Reads the typed in sample size, showing why it's invalid for a
+        table of total data points'''
 
         # Check if sample size is given
         if self.sample_entry.get().strip():
@@ -252,7 +383,7 @@ class ChiPage(DefaultWindow):
             return False
 
         # Check if sum > sample size
-        if sum(values_only.flatten()) < self.sample_size:
+        if total < self.sample_size:
             self.label_status['text'] = 'Invalid, sample size must be smaller than the number of data points'
             return False
 
@@ -260,39 +391,18 @@ class ChiPage(DefaultWindow):
         if self.sample_size % 10 != 0:
             self.label_status['text'] = 'Invalid, sample size must be a multiple of 10'
             return False
-            
-        # Generate data_values with the full list version of a pd df
-        rows = values[:, 0][1:shape[0] + 1]
-        cols = values[0][1:shape[1] + 1]
-        self.data_values = self.make_df(values_only.tolist(), rows, cols)
 
-        if not export:
+        return True
 
-            # Discard elements
-            self.table_frame.destroy()
-            self.button_go.destroy()
-            self.sample_entry.destroy()
-            self.inst.destroy()
-            self.files_frame.destroy()
-            
-            # Generate function
-            self._simulation_page()
-            
-        else:
-            try:
-                data_export = (self.data_values, self.sample_size)
-                pickle.dump(data_export, open(os.path.join("/Users", os.environ["USER"], "Desktop", "save.stat"), "wb"))
-            except Exception:
-                self.label_status['text'] = 'Error'
+
+    def _ask_session_file(self):
+        return tk.filedialog.asksaveasfilename(initialdir = os.path.expanduser("~"), defaultextension = session.EXTENSION, filetypes = (("Session Files", "*.session"),))
 
 
     def _random_2_chosen(self):
 
         # Formatting data for use
-        data = [[random.randint(211, 225), random.randint(211, 225)], [random.randint(211, 225), random.randint(211, 225)]]
-        columns = ["Democrats", "Republicans"]
-        rows = ["Men", "Women"]
-        self.data_values = self.make_df(data, rows, columns)
+        self.data_values = engine.random_table(2, self.stream.generator())
         self.sample_size = 100
 
         # Starts generation
@@ -303,10 +413,7 @@ class ChiPage(DefaultWindow):
     def _random_3_chosen(self):
 
         # Formatting data for use
-        data = [[random.randint(94, 100), random.randint(94, 100), random.randint(94, 100)], [random.randint(94, 100), random.randint(94, 100), random.randint(94, 100)], [random.randint(94, 100), random.randint(94, 100), random.randint(94, 100)]]
-        columns = ["Democrats", "Republicans", "Independent"]
-        rows = ["Men", "Women", "Undeclared"]
-        self.data_values = self.make_df(data, rows, columns)
+        self.data_values = engine.random_table(3, self.stream.generator())
         self.sample_size = 100
 
         # Starts generation
@@ -315,31 +422,18 @@ class ChiPage(DefaultWindow):
 
 
     def make_df(self, data, rows, columns):
-        df = pd.DataFrame.from_records(data, index = rows, columns = columns)
-        df.loc['Total'] = df.sum(numeric_only=True, axis=0)
-        df.loc[:,'Total'] = df.sum(numeric_only=True, axis=1)
-        data_values = df.reset_index().T.reset_index().T.values
-        data_values[0, 0] = ''
-        return data_values
+        return engine.make_table(data, rows, columns)
 
 
     def _simulation_page(self):
 
         # Initialise components - table
-        table_frame = tk.Frame(self.frame, bg = self.bg_color, highlightbackground = self.fg_color, highlightthickness = 1)
-        
-        for row in range(self.data_values.shape[0]):
-            for col in range(self.data_values.shape[1]):
-                if row == 0 or col == 0:
-                    tk.Label(table_frame, text = self.data_values[row, col], bg = self.bg_color, font = self.normal_font).grid(row = row, column = col)
-                else:
-                    tk.Label(table_frame, text = self.data_values[row, col], bg = self.bg_color, font = self.normal_light_font).grid(row = row, column = col)
-
-        table_frame.pack()
+        TableGrid(self.frame, self.data_values, self.bg_color, self.fg_color, self.normal_light_font, self.normal_font, max_height = 150).frame.pack()
 
         # Initialise simulation
         self.cycle_count = 0
-        self.nearest_square = math.ceil(self.data_values[-1, -1] ** 0.5)
+        self.grid_counts = self._grid_counts(engine.table_counts(self.data_values).flatten())
+        self.nearest_square = math.ceil(self.grid_counts.sum() ** 0.5)
 
         # Configure graph
         plt.style.use('fast')
@@ -355,9 +449,24 @@ class ChiPage(DefaultWindow):
         # Set data
         self.total_runs = 0
         self.data = np.zeros((self.nearest_square, self.nearest_square)) + 0.06
-        self.data2 = []
         self.plot = self.ax[0].imshow(self.data, cmap='binary', vmin = 0, vmax = 1)
-        self.ax[1].hist(self.data2)
+
+        # Histogram bars and the distribution line are made once, and only
+        # their heights change as runs are added
+        self.dof = engine.chi_dof(engine.table_counts(self.data_values).shape)
+        self.histogram = Histogram.for_chi2(self.dof)
+        self.sketch = QuantileSketch()
+        width = self.histogram.width
+        self.bars = self.ax[1].bar(self.histogram.edges, 0, width = width, align = 'edge')
+        self.bars[-1].set_color('grey')
+        self.line_x, self.line_pdf = distcache.curve('chi2', self.dof, distcache.CHI_START, self.histogram.edges[-1])
+        self.line, = self.ax[1].plot(self.line_x, np.zeros_like(self.line_x), color='r', lw=2, visible = False)
+
+        # Simulated and theoretical critical values at the middle level
+        self.critical_line = self.ax[1].axvline(0, color = 'orange', lw = 2, visible = False)
+        self.critical_theory = self.ax[1].axvline(distcache.quantile('chi2', self.dof, CRITICAL_LEVELS[1]), color = 'r', ls = '--', visible = False)
+        self.ax[1].set_xlim(0, self.histogram.edges[-1] + width)
+        self.ax[1].set_ylim(0, 1)
 
         # Display graph
         canvas = FigureCanvasTkAgg(self.fig, master = self.frame)
@@ -377,79 +486,329 @@ class ChiPage(DefaultWindow):
         self.button_start3 = tk.Button(button_frame, text = 'Run 1000 times', height = 2, font = self.normal_font, command = self._run_1000, padx = 10)
         self.button_start3.pack(expand = True, fill = tk.X, side = 'left')
 
+        self.button_start4 = tk.Button(button_frame, text = 'Run 100000 times', height = 2, font = self.normal_font, command = self._run_100000, padx = 10)
+        self.button_start4.pack(padx = (20, 0), expand = True, fill = tk.X, side = 'left')
+
         self.line_shown = False
         tk.Button(button_frame, text = 'Show line', height = 2, font = self.normal_font, command = self._show_line, padx = 10).pack(padx = 20, expand = True, fill = tk.X, side = 'left')
 
+        # Fixed margin mode needs a table that can be tested itself
+        self.fixed_margins = False
+        try:
+            self.observed = engine.observed_chi2(engine.table_counts(self.data_values))
+        except ValueError:
+            self.observed = None
+        self.button_mode = tk.Button(button_frame, text = 'Fixed margins', height = 2, font = self.normal_font, command = self._toggle_mode, padx = 10)
+        self.button_mode.pack(expand = True, fill = tk.X, side = 'left')
+        if self.observed is None:
+            self.button_mode['state'] = tk.DISABLED
+
         button_frame.pack(pady = (0, 20))
+
+        # Progress of background runs
+        progress_frame = tk.Frame(bottom_frame, bg = self.bg_color)
+
+        self.progress = ttk.Progressbar(progress_frame, length = 400, mode = 'determinate')
+        self.progress.pack(side = 'left', padx = (0, 20))
+
+        self.button_cancel = tk.Button(progress_frame, text = 'Cancel', font = self.normal_font, command = self._cancel, padx = 10, state = tk.DISABLED)
+        self.button_cancel.pack(side = 'left')
+
+        progress_frame.pack(pady = (0, 10))
         
         self.chi_label = tk.Label(bottom_frame, text = '', bg = self.bg_color, font = self.normal_light_font)
-        self.chi_label.pack(pady = (0, 20))
+        self.chi_label.pack(pady = (0, 10))
+
+        self.critical_label = tk.Label(bottom_frame, text = '', bg = self.bg_color, font = self.normal_light_font)
+        self.critical_label.pack(pady = (0, 10))
+
+        seed_frame = tk.Frame(bottom_frame, bg = self.bg_color)
+
+        tk.Label(seed_frame, text = f'Seed: {self.stream.seed}', bg = self.bg_color, fg = self.fg_color, font = self.normal_light_font).pack(side = 'left', padx = (0, 20))
+
+        self.button_save = tk.Button(seed_frame, text = 'Save session', font = self.normal_font, command = self._save_session, padx = 10)
+        self.button_save.pack(side = 'left')
+
+        self.button_export = tk.Button(seed_frame, text = 'Export replicates', font = self.normal_font, command = self._toggle_export, padx = 10)
+        self.button_export.pack(side = 'left', padx = (20, 0))
+
+        # Any replicate can be drawn again on its own and shown with the run once animation
+        tk.Label(seed_frame, text = 'Replicate:', bg = self.bg_color, fg = self.fg_color, font = self.normal_light_font).pack(side = 'left', padx = (20, 5))
+        self.replicate_entry = tk.Entry(seed_frame, width = 10, font = self.normal_light_font)
+        self.replicate_entry.pack(side = 'left')
+        self.button_replay = tk.Button(seed_frame, text = 'Show replicate', font = self.normal_font, command = self._show_replicate, padx = 10)
+        self.button_replay.pack(side = 'left', padx = (5, 0))
+
+        seed_frame.pack(pady = (0, 10))
 
         bottom_frame.pack()
             
 
     def _run(self):
+        self.replicate = self.stream.take(1, engine.CHI_SAMPLER).first
+        self.replaying = False
+        self._animate()
+
+
+    def _show_replicate(self):
+
+        # Replays a replicate already drawn, without adding it again
+        try:
+            replicate = int(self.replicate_entry.get())
+            if replicate < 0:
+                raise ValueError
+        except ValueError:
+            self.chi_label['text'] = 'Error: the replicate must be a whole number from 0'
+            return
+
+        # Draw it again with the sampler that made it
+        drawn = self.stream.sampler_of(replicate)
+        if drawn is None:
+            self.chi_label['text'] = f'Error: replicate {replicate} has not been drawn'
+            return
+        sampler, block = drawn
+        if sampler == engine.FIXED_SAMPLER:
+            self._show_fixed(replicate, block)
+            return
+        self.replicate = replicate
+        self.replaying = True
+        self._animate()
+
+
+    def _show_fixed(self, replicate, block):
+
+        # Fixed margin tables hold every individual, so there's no sample to animate
+        table = engine.chi_fixed_tables(engine.table_counts(self.data_values), 1, parallel.Replicates(self.stream.seed, replicate, block))
+        chi2, valid = engine.chi_statistics(table)
+        p = engine.chi_p_values(chi2, self.dof)
+        self.chi_label['text'] = f'Replicate {replicate} (fixed margins): Chi Squared Value: {round(chi2[0], 4)}, degrees of freedom: {self.dof}, p-value: {round(p[0], 4)}'
+
+
+    @timed('run once frame', frame = True)
+    def _animate(self):
+
+        # Draw the replicate's table, then pick which of each cell's individuals
+        # it sampled, split over 10 frames. The figure is cached without the grid
+        # so frames only redraw the grid
+        if self.cycle_count == 0:
+            self._set_run_state(tk.DISABLED)
+            data_og = engine.table_counts(self.data_values)
+            self.sample = engine.chi_tables(data_og, self.sample_size, 1, parallel.Replicates(self.stream.seed, self.replicate))[0]
+            self.reveal = np.array_split(self._sample_cells(self.sample), 10)
+            self.plot.set_data(self.data)
+            self.plot.set_animated(True)
+            self.fig.canvas.draw()
+            self.background = self.fig.canvas.copy_from_bbox(self.ax[0].bbox)
 
         # Animate for a 100 points
         if self.cycle_count < 10:
-            self.button_start['state'] = tk.DISABLED
-            self.button_start2['state'] = tk.DISABLED
-            self.button_start3['state'] = tk.DISABLED
-            for _ in range(int(self.sample_size / 10)):
-                point = (random.randint(0, self.nearest_square - 1), random.randint(0, self.nearest_square - 1))
-                while self.data[point[0], point[1]] != 0.06:
-                    point = (random.randint(0, self.nearest_square - 1), random.randint(0, self.nearest_square - 1))
-                self.data[point[0], point[1]] = 0.89
+            self.data.flat[self.reveal[self.cycle_count]] = 0.89
             self.plot.set_data(self.data)
-            self.fig.canvas.draw()
-            self.canvas_widget.after(100, self._run)
+            self.fig.canvas.restore_region(self.background)
+            self.ax[0].draw_artist(self.plot)
+            self.fig.canvas.blit(self.ax[0].bbox)
+            self.canvas_widget.after(100, self._animate)
             self.cycle_count += 1
         else:
             self.cycle_count = 0
-            self.total_runs += 1
-            self.button_start['state'] = tk.NORMAL
-            self.button_start2['state'] = tk.NORMAL
-            self.button_start3['state'] = tk.NORMAL
-            self.data = np.zeros((self.nearest_square, self.nearest_square)) + 0.06
+            self._set_run_state(tk.NORMAL)
+            self.plot.set_animated(False)
+            self.background = None
+            if not self.replaying:
+                self.total_runs += 1
             try:
-                self._chi(single = True)
+                self._chi(self.sample)
                 self._chi_update()
             except ValueError:
-                self.chi_label['text'] = 'Error: Got a 0 column'
+                self.chi_label['text'] = f'Error: replicate {self.replicate} got a 0 column'
+            self._update_session()
+
+
+    def _grid_counts(self, counts):
+        '''Individuals of each table cell on the run once grid'''
+        total = counts.sum()
+        if total <= MAX_GRID_CELLS:
+            return counts
+
+        # Scale down, giving the cells left over to the largest remainders
+        scaled = counts * MAX_GRID_CELLS / total
+        grid = np.floor(scaled).astype(np.int64)
+        grid[np.argsort(grid - scaled)[:MAX_GRID_CELLS - grid.sum()]] += 1
+        return grid
+
+
+    def _sample_cells(self, sample):
+        '''Grid cells of the individuals a sampled table picked. The grid holds
+        the table's individuals cell by cell, lightly shaded in turn, and each
+        cell's sample count is revealed among its own individuals'''
+
+        # Where each individual is placed within its cell only depends on the replicate
+        rng = np.random.default_rng([self.stream.seed, self.replicate])
+        counts = self.grid_counts
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self.data[:] = 0.06
+        cells = []
+        for i, (start, count, sampled) in enumerate(zip(starts, counts, sample.flatten())):
+            if i % 2:
+                self.data.flat[start:start + count] = 0.2
+            cells.append(start + rng.choice(count, min(sampled, count), replace = False))
+        return rng.permutation(np.concatenate(cells))
 
 
     def _run_100(self):
-        self.button_start['state'] = tk.DISABLED
-        self.button_start2['state'] = tk.DISABLED
-        self.button_start3['state'] = tk.DISABLED
-        for _ in range(100):
-            try:
-                self._chi()
-            except ValueError:
-                continue
-        self.button_start['state'] = tk.NORMAL
-        self.button_start2['state'] = tk.NORMAL
-        self.button_start3['state'] = tk.NORMAL
-        self.total_runs += 100
-        self._chi_update()
-        self.chi_label['text'] = ''
+        self._run_batch(100)
 
 
     def _run_1000(self):
-        self.button_start['state'] = tk.DISABLED
-        self.button_start2['state'] = tk.DISABLED
-        self.button_start3['state'] = tk.DISABLED
-        for _ in range(100):
-            try:
-                self._chi()
-            except ValueError:
-                continue
-        self.button_start['state'] = tk.NORMAL
-        self.button_start2['state'] = tk.NORMAL
-        self.button_start3['state'] = tk.NORMAL
-        self.total_runs += 1000
-        self._chi_update()
+        self._run_batch(1000)
+
+
+    def _run_100000(self):
+        self._run_batch(100000)
+
+
+    def _run_batch(self, runs):
+
+        # Hand the runs to a background worker, and poll it for finished batches
+        self._set_run_state(tk.DISABLED)
+        self.button_cancel['state'] = tk.NORMAL
+        self.progress['maximum'] = runs
+        self.progress['value'] = 0
         self.chi_label['text'] = ''
+        self.batches_drawn = 0
+        self.next_replicate = self.stream.replicates
+        data_og = engine.table_counts(self.data_values)
+        if self.fixed_margins:
+            job, args, sampler, block = engine.chi_fixed_batch, (data_og,), engine.FIXED_SAMPLER, engine.fixed_margin_block(data_og.shape)
+        else:
+            job, args, sampler, block = engine.chi_batch, (data_og, self.sample_size), engine.CHI_SAMPLER, parallel.REPLICATE_BLOCK
+        batches = parallel.run_batches(job, args, runs, self.stream, workers = parallel.default_workers(), sampler = sampler, block = block)
+        self.worker = BatchWorker(batches).start()
+        self.canvas_widget.after(POLL_MS, self._poll_batch)
+
+
+    def _poll_batch(self):
+
+        # Record every finished batch, redrawing every few batches
+        for runs, result in self.worker.poll():
+            self._record(result, self.next_replicate)
+            self.next_replicate += runs
+            self.total_runs += runs
+            self.progress['value'] += runs
+            self.batches_drawn += 1
+            if self.batches_drawn % REDRAW_EVERY == 0:
+                self._chi_update()
+
+        if not self.worker.finished:
+            self.canvas_widget.after(POLL_MS, self._poll_batch)
+            return
+
+        # Finished or cancelled
+        self.button_cancel['state'] = tk.DISABLED
+        self._set_run_state(tk.NORMAL)
+        self._chi_update()
+        if self.worker.error is not None:
+            self.chi_label['text'] = 'Error: the simulation failed'
+        elif self.worker.cancelled.is_set():
+            self.chi_label['text'] = f'Cancelled after {int(self.progress["value"])} runs'
+        if self.fixed_margins and self.worker.error is None:
+            self._fixed_margin_label()
+        self._update_session()
+        self.worker = None
+
+
+    def _cancel(self):
+        if self.worker is not None:
+            self.worker.cancel()
+
+
+    def _set_run_state(self, state):
+
+        # Run once animates a sample, so it has no place in fixed margin mode
+        self.button_start['state'] = tk.DISABLED if self.fixed_margins else state
+        self.button_start2['state'] = state
+        self.button_start3['state'] = state
+        self.button_start4['state'] = state
+        self.button_save['state'] = state
+        self.button_replay['state'] = state
+        if self.observed is not None:
+            self.button_mode['state'] = state
+
+
+    def _toggle_mode(self):
+
+        # Switching between sampling and fixed margin tables starts a new
+        # histogram, which the saved session's replicates don't belong to
+        self.session = None
+        self.fixed_margins = not self.fixed_margins
+        self.button_mode['text'] = 'Sampling' if self.fixed_margins else 'Fixed margins'
+        self.histogram = Histogram.for_chi2(self.dof)
+        self.sketch = QuantileSketch()
+        self.total_runs = 0
+        self.exceeding = 0
+        self._set_run_state(tk.NORMAL)
+        self._chi_update()
+        if self.fixed_margins:
+            self.chi_label['text'] = f'Random tables with the same totals, observed chi squared value: {round(self.observed, 4)}'
+        else:
+            self.chi_label['text'] = ''
+
+
+    def _save_session(self):
+
+        # Save the state so far, and add new replicates to the new file from now on
+        try:
+            file_name = self._ask_session_file()
+            if not file_name:
+                return
+            self.session = session.Session.create(file_name, self._session_header())
+            self.chi_label['text'] = f'Saved session to {os.path.basename(file_name)}'
+        except Exception:
+            self.session = None
+            self.chi_label['text'] = 'Error: could not save the session'
+
+
+    def _toggle_export(self):
+        self.exporter.toggle(self.stream.seed, self.button_export, self.chi_label)
+
+
+    def _session_header(self):
+        return session.make_header(self.data_values, self.sample_size, seed = self.stream.seed, spawned = self.stream.spawned,
+                                   replicates = self.stream.replicates, samplers = self.stream.samplers, histogram = self.histogram, sketch = self.sketch, total_runs = self.total_runs,
+                                   fixed_margins = self.fixed_margins, exceeding = self.exceeding)
+
+
+    def _update_session(self):
+        if self.session is not None:
+            self.session.update(self._session_header())
+
+
+    def _restore(self, header):
+
+        # Pick up the histogram and mode a session was saved with
+        self.total_runs = header['total_runs']
+        if header['fixed_margins'] and self.observed is not None:
+            self.fixed_margins = True
+            self.button_mode['text'] = 'Sampling'
+            self.exceeding = header['exceeding']
+            self._set_run_state(tk.NORMAL)
+        saved = header['histogram']
+        if saved is not None and np.allclose(saved['edges'], self.histogram.edges):
+            self.histogram.counts = np.array(saved['counts'], dtype = np.int64)
+            self.histogram.total = int(self.histogram.counts.sum())
+        if header.get('sketch') is not None:
+            self.sketch = QuantileSketch.from_dict(header['sketch'])
+        self._chi_update()
+        if self.fixed_margins and self.histogram.total:
+            self._fixed_margin_label()
+        else:
+            self.chi_label['text'] = f'Opened session with {self.total_runs} runs, {self.session.count} saved replicates'
+
+
+    def _fixed_margin_label(self):
+        p, se = engine.monte_carlo_p(self.exceeding, self.histogram.total)
+        asymptotic = engine.chi_p_values(self.observed, self.dof)
+        self.chi_label['text'] = f'Monte Carlo p-value: {round(p, 4)} ± {round(se, 4)} from {self.histogram.total} tables, asymptotic p-value: {round(asymptotic, 4)}'
         
 
     def _show_line(self):
@@ -461,50 +820,73 @@ class ChiPage(DefaultWindow):
             self._chi_update()
 
 
-    def _chi(self, single = False):
+    @timed('chi')
+    def _chi(self, sample):
         
-        # Make random selection
-        counter = 0
-        weights = []
-        data_og = self.data_values[1:-1, 1:-1]
-        data_prob = data_og.flatten()
-        data_prob = data_prob / sum(data_prob)
-        choices = random.choices(range(len(data_prob)), data_prob, k = self.sample_size)
-        new_data = list(Counter(choices).items())
-
-        if len(new_data) != len(data_prob):
-            chosen_elements = set()
-            for i in new_data:
-                if i[0] not in chosen_elements:
-                    chosen_elements.add(i[0])
-            unchosen = set(range(len(data_prob))) - chosen_elements
-            for i in list(unchosen):
-                new_data.append((i, 0))
-        new_data = np.array([j for i,j in sorted(new_data)]).reshape(data_og.shape)
-
-        # Chi runner
-        try:
-            chi2, p, self.dof, expected = scstats.chi2_contingency(new_data, correction = False)
-            self.data2.append(chi2)
-            if single:
-                self.chi_label['text'] = f'Chi Squared Value: {round(chi2, 4)}, degrees of freedom: {self.dof}, p-value: {round(p, 4)}'
-        except Exception:
+        # Test the animated replicate's table, the same as a batch would
+        chi2, valid = engine.chi_statistics(sample[None])
+        p = engine.chi_p_values(chi2, self.dof)
+
+        # Replicates with a 0 row or column can't be tested, so a single run
+        # reports them while batches leave them out
+        if not valid[0]:
             raise ValueError
+        if not self.replaying:
+            self._record((chi2, p, self.dof, valid), self.replicate)
+        self.chi_label['text'] = f'Replicate {self.replicate}: Chi Squared Value: {round(chi2[0], 4)}, degrees of freedom: {self.dof}, p-value: {round(p[0], 4)}'
+
+
+    def _record(self, result, first):
+        '''Adds replicates first onwards to the histogram, session and export'''
+        chi2, p, self.dof, valid = result
+        with profiler.phase('histogram', runs = len(chi2)):
+            self.histogram.add(chi2[valid])
+            self.sketch.add(chi2[valid])
+        profiler.count(len(chi2))
+        if self.session is not None:
+            self.session.append(chi2[valid])
+        if self.exporter.writer is not None:
+            with profiler.phase('export', runs = len(chi2)):
+                self.exporter.writer.write(chi2[valid], p[valid], self.dof, (first + np.arange(len(chi2)))[valid])
+        if self.fixed_margins:
+            self.exceeding += engine.at_least(chi2[valid], self.observed).sum()
             
 
+    @timed('chi update', frame = True)
     def _chi_update(self):
-        self.ax[1].cla()
-        self.ax[1].hist(self.data2, bins = 50)
-        self.ax[1].set_title('Chi Square Distribution')
-        try:
-            if self.line_shown:
-                x = np.linspace(0.01, max(self.data2), 50)
-                area = len(self.data2) * (x[1] - x[0])
-                self.ax[1].plot(x, area * scstats.chi2.pdf(x, df = self.dof), color='r', lw=2)
-        except Exception:
-            pass
-        self.fig.canvas.draw()
-        if self.total_runs >= 10000:
-            self.button_start['state'] = tk.DISABLED
-            self.button_start2['state'] = tk.DISABLED
-            self.button_start3['state'] = tk.DISABLED
+
+        # Update the existing bars, so a redraw costs the same however many runs there are
+        counts = self.histogram.counts
+        for bar, count in zip(self.bars, counts):
+            bar.set_height(count)
+
+        # Expected counts per bin if the null hypothesis holds
+        if self.line_shown:
+            self.line.set_ydata(self.histogram.total * self.histogram.width * self.line_pdf)
+        self.line.set_visible(self.line_shown)
+        self._critical_update()
+
+        self.ax[1].set_ylim(0, max(counts.max(), 1) * 1.1)
+        with profiler.phase('draw'):
+            self.fig.canvas.draw()
+
+
+    def _critical_update(self):
+
+        # Critical values of the simulated statistics from the sketch, next to
+        # those of the chi square distribution they should approach
+        if len(self.sketch) == 0:
+            self.critical_label['text'] = ''
+            self.critical_line.set_visible(False)
+            self.critical_theory.set_visible(False)
+            return
+
+        with profiler.phase('critical values'):
+            simulated = self.sketch.quantile(CRITICAL_LEVELS)
+            distance = self.sketch.ks_distance(self.dof)
+        values = ', '.join(f'{round(level * 100)}%: {round(value, 2)} vs {round(distcache.quantile("chi2", self.dof, level), 2)}'
+                           for level, value in zip(CRITICAL_LEVELS, simulated))
+        self.critical_label['text'] = f'Critical values, simulated vs theoretical - {values}, KS distance: {round(distance, 4)}'
+        self.critical_line.set_xdata([simulated[1], simulated[1]])
+        self.critical_line.set_visible(True)
+        self.critical_theory.set_visible(self.line_shown)
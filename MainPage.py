@@ -1,9 +1,15 @@
 from DefaultWindow import DefaultWindow
-from ChiPage import ChiPage
-from TPage import TPage
 
 import tkinter as tk
 
+import importlib
+import threading
+
+
+# Pages import matplotlib, pandas and SciPy, so they're only imported once the
+# menu is up, in the background or when a page is first opened
+PAGE_MODULES = ('ChiPage', 'TPage')
+
 
 class MainPage(DefaultWindow):
     '''MainPage class for the first to start UI element'''
@@ -29,12 +35,29 @@ class MainPage(DefaultWindow):
         t_test_button = tk.Button(self.frame, text='T Test', fg = self.fg_color, bg = self.bg_color, font = self.text_font, command = self.t_test_window)
         t_test_button.grid(row = 1, column = 1, padx = (10, 20), pady = (0, 20), sticky = "NSEW")
 
+        # Warm the pages once the menu has been drawn
+        self.frame.after_idle(self._warm_pages)
+
+
+    def _warm_pages(self):
+        threading.Thread(target = _import_pages, daemon = True).start()
+
 
     def chi_window(self):
+        from ChiPage import ChiPage
         self.root = tk.Toplevel(self.parent)
         ChiPage(self.root)
 
 
     def t_test_window(self):
+        from TPage import TPage
         self.root = tk.Toplevel(self.parent)
         TPage(self.root)
+
+
+def _import_pages():
+
+    # Imports take the import lock, so opening a page while this runs waits
+    # for it to finish rather than importing twice
+    for name in PAGE_MODULES:
+        importlib.import_module(name)
@@ -0,0 +1,76 @@
+from profiling import profiler, rss
+
+import tkinter as tk
+from tkinter import filedialog
+
+import os
+
+
+# Time between refreshes of the overlay, in ms
+REFRESH_MS = 500
+
+# Phases listed, the ones with the most time first
+SHOWN_PHASES = 4
+
+
+class ProfileOverlay:
+    '''ProfileOverlay class for a panel in the corner of a page showing the
+    replicates per second, frame times, memory and slowest phases. F12 shows
+    and hides it, and profiling is only on while it's shown'''
+
+
+    def __init__(self, page):
+
+        # Panel properties
+        self.page = page
+        self.shown = False
+        self.refresh_id = None
+        self.was_enabled = profiler.enabled
+        self.frame = tk.Frame(page.frame, bg = page.fg_color, padx = 10, pady = 10)
+
+        self.label = tk.Label(self.frame, text = '', justify = tk.LEFT, anchor = 'w', fg = page.bg_color, bg = page.fg_color, font = ('Courier', 11))
+        self.label.pack(fill = tk.X)
+
+        tk.Button(self.frame, text = 'Export trace', font = ('Courier', 11), command = self._export).pack(pady = (10, 0))
+
+        page.parent.bind('<F12>', lambda event: self.toggle())
+
+
+    def toggle(self):
+        if self.shown:
+            self.shown = False
+            self.frame.after_cancel(self.refresh_id)
+            self.frame.place_forget()
+            profiler.enabled = self.was_enabled
+        else:
+            self.shown = True
+            self.was_enabled = profiler.enabled
+            profiler.enabled = True
+            self.frame.place(relx = 1, rely = 0, anchor = 'ne')
+            self.frame.lift()
+            self._refresh()
+
+
+    def _refresh(self):
+        last, mean = profiler.frame_ms()
+        memory = rss()
+        lines = [f'Replicates/s  {profiler.rate():>12,.0f}',
+                 f'Frame         {"-" if last is None else f"{last:.1f} ms (mean {mean:.1f})":>12}',
+                 f'Memory        {"-" if memory is None else f"{memory / 2 ** 20:,.0f} MiB":>12}']
+
+        # Slowest phases so far
+        phases = sorted(profiler.summary().items(), key = lambda item: -item[1]['total_ms'])
+        for name, phase in phases[:SHOWN_PHASES]:
+            lines.append(f'{name[:14]:<14}{phase["mean_ms"]:>8.2f} ms x{phase["count"]}')
+
+        self.label['text'] = '\n'.join(lines)
+        self.refresh_id = self.frame.after(REFRESH_MS, self._refresh)
+
+
+    def _export(self):
+        file_name = filedialog.asksaveasfilename(initialdir = os.path.expanduser("~"), defaultextension = '.json', filetypes = (("Trace Files", "*.json"),))
+        if file_name:
+            try:
+                profiler.export(file_name)
+            except OSError:
+                self.label['text'] += '\nCould not save the trace'
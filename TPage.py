@@ -1,4 +1,14 @@
 from DefaultWindow import DefaultWindow
+from ProfileOverlay import ProfileOverlay
+from profiling import profiler, timed
+from worker import BatchWorker, ImportWorker
+import bootstrap
+import distcache
+import engine
+import export
+import loader
+import parallel
+import render
 
 import tkinter as tk
 
@@ -7,17 +17,45 @@ matplotlib.use('TkAgg')
 
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib import pyplot as plt
+from matplotlib.colors import LogNorm
+from matplotlib.patches import Polygon
 
 import numpy as np
-import pandas as pd
-from scipy import stats as scstats
 
-import random
 import os
+import time
 
 
 # NOTE - USE GLOBAL VARIABLES ONLY FOR FUNCTIONS, UI ELEMENTS AND GLOBALS FUNC
 
+# Background runs - queue polling interval
+POLL_MS = 50
+
+# Files with more columns test every pair - significance level, smallest
+# P value coloured and most columns labelled on the heatmap
+ALPHA = 0.05
+MIN_P_SHOWN = 1e-4
+MAX_LABELLED_COLUMNS = 30
+
+# Power analysis grid - effect sizes, sample sizes per group, effect sizes
+# drawn as curves, power wanted, and tests per point in each batch
+POWER_EFFECTS = np.linspace(0.02, 1, 50)
+POWER_SIZES = np.arange(5, 255, 5)
+CURVE_EFFECTS = (0.2, 0.5, 0.8)
+TARGET_POWER = 0.8
+POWER_BATCH = 500
+
+# Bootstrap resamples per run and per batch, and the interval level
+BOOTSTRAP_RUNS = 10000
+BOOTSTRAP_BATCH = 1000
+BOOTSTRAP_LEVEL = 0.95
+
+# Auto-run frame rate, and how the graph limits follow the data - they're
+# moved with this margin once the data leaves them or fills less than this fraction
+AUTO_RUN_FPS = 30
+LIMIT_MARGIN = 0.2
+LIMIT_FILL = 0.5
+
 class TPage(DefaultWindow):
     '''TPage class for the T test simulation'''
 
@@ -33,60 +71,102 @@ class TPage(DefaultWindow):
         self.button_frame = tk.Frame(self.frame, bg = self.bg_color)
         tk.Button(self.button_frame, text = 'Import data', height = 2, font = self.normal_font, command = self._import, padx = 10).pack(padx = 20, expand = True, fill = tk.X, side = 'left')
         tk.Button(self.button_frame, text = 'Random data', height = 2, font = self.normal_font, command = self._random, padx = 10).pack(padx = 20, expand = True, fill = tk.X, side = 'left')
+        tk.Button(self.button_frame, text = 'Power analysis', height = 2, font = self.normal_font, command = self._power_screen, padx = 10).pack(padx = 20, expand = True, fill = tk.X, side = 'left')
         self.button_frame.pack()
 
         self.error_label = tk.Label(self.frame, text = '', height = 2, fg = self.fg_color, bg = self.bg_color, font = self.normal_light_font)
         self.error_label.pack(pady = 10)
 
+        # Shown while a file is read
+        self.cancel_button = tk.Button(self.frame, text = 'Cancel', height = 2, font = self.normal_font, command = lambda: self.worker.cancel(), padx = 10)
+
+        # Seeded replicates for the random data mode
+        self.stream = parallel.SeededStream()
+        self.worker = None
+        self.next_replicate = None
+
+        # File random replicates are exported to, finished when the window closes
+        self.exporter = export.ExportControl()
+        self.frame.bind('<Destroy>', self.exporter.close)
+        distcache.warm_in_background()
+
+        # Samples the bootstrap resamples, read from the imported file when first needed
+        self.file_name = None
+        self.samples = None
+        self.boot_bars = None
+
+        # Auto-run state, and the figure without the moving artists for blitting
+        self.auto_id = None
+        self.background = None
+
+        # Timings overlay, shown with F12
+        self.overlay = ProfileOverlay(self)
+
 
     def _import(self):
 
         # Import file
-        file_name = tk.filedialog.askopenfilename(initialdir = os.path.join("/Users", os.environ["USER"], "Desktop"), filetypes = (("CSV Files", "*.csv"),))
+        file_name = tk.filedialog.askopenfilename(initialdir = os.path.expanduser(os.path.join("~", "Desktop")), filetypes = (("CSV Files", "*.csv"),))
         if not file_name:
             return False
+        try:
+            self.worker = ImportWorker(self._read_file(file_name), file_name)
+        except OSError:
+            self.error_label.config(text = "Error! File could not be read")
+            return False
 
-        # Access CSV data
-        data = pd.read_csv(file_name)
-        data = data.dropna(axis=1, how='all')
-        data = data.T.reset_index().T
+        # Read the file on a background worker, keeping the menu until the
+        # statistics are ready
+        self._set_menu_state("disabled")
+        self.cancel_button.pack(pady = (0, 10))
+        self.error_label.config(text = "Reading file...")
+        self.worker.watch(self.error_label, POLL_MS, lambda text: self.error_label.config(text = text),
+                          lambda stats, message: self._import_finished(file_name, stats, message), error_prefix = "Error! ")
 
-        # Make sure data has 2 columns
-        if data.shape[1] != 2:
-            print(data.shape)
-            self.error_label.config(text = "Error! File must have 2 columns")
-            return False
 
-        # Make sure all values are integers
-        try:
-            [int(x) for x in data if x != None]
-        except Exception:
-            self.error_label.config(text = "Error! File must have only numbers")
-            return False
+    def _read_file(self, file_name):
 
-        # Generate table data
-        try:
+        # Stream the CSV data, keeping only running statistics of each column
+        with profiler.phase('read csv'):
+            for read, stats in loader.iter_column_stats(file_name):
+                if stats is not None and len(stats.n) < 2:
+                    raise ValueError('File must have at least 2 columns')
+                yield read, stats
+
+
+    def _import_finished(self, file_name, stats, message):
+
+        # Back to the menu unless the file was read in full
+        self.worker = None
+        self.cancel_button.pack_forget()
+        self._set_menu_state("normal")
+        if stats is None:
+            self.error_label.config(text = message)
+            return
+        self._imported(file_name, stats)
 
-            a = data[0].astype(np.float64)
-            a = a[~np.isnan(a)]
-            b = data[1].astype(np.float64)
-            b = b[~np.isnan(b)]
-            
-            table_data = np.array([["", "Data A", "Data B"],
-                                  ["Mean", round(a.mean(), 2), round(b.mean(), 2)],
-                                  ["Variance", round(a.var(ddof = 1), 2), round(b.var(ddof = 1), 2)],
-                                  ["Elements", len(a), len(b)]])
 
-        except Exception:
-            self.error_label.config(text = "Error!")
+    def _set_menu_state(self, state):
+        for button in self.button_frame.winfo_children():
+            button.config(state = state)
+
+
+    @timed('t import')
+    def _imported(self, file_name, stats):
+
+        # Files with more than 2 columns compare every pair of columns
+        if len(stats.n) > 2:
+            self._pairs_screen(stats)
+            return
 
         # Make the graph
+        self.file_name = file_name
         self._make_screen()
 
-        # Disable run button
-        self.run_but.config(state = "disabled")
+        # Only the bootstrap runs on imported data
+        self._set_run_state("normal")
 
-        self._update(table_data, a, b)
+        self._update(stats.n, stats.mean, stats.var)
         
 
     def _random(self):
@@ -97,19 +177,90 @@ class TPage(DefaultWindow):
 
 
     def _new_random(self):
+        self._show_pair(self.stream.take(1, engine.T_SAMPLER).first, record = True)
+
 
-        # Generate random data
-        a = np.random.normal(loc = 50, scale = 5, size = random.randint(20, 60))
-        b = np.random.normal(loc = 50, scale = 5, size = random.randint(20, 60)) + random.randint(-4, 4)
+    def _show_replicate(self):
 
-        # Generate table data
-        table_data = np.array([["", "Data A", "Data B"],
-                              ["Mean", round(a.mean(), 2), round(b.mean(), 2)],
-                              ["Variance", round(a.var(ddof = 1), 2), round(b.var(ddof = 1), 2)],
-                              ["Elements", len(a), len(b)]])
+        # Replays a replicate already drawn, without exporting it again
+        try:
+            replicate = int(self.replicate_entry.get())
+            if replicate < 0:
+                raise ValueError
+        except ValueError:
+            self.status_label.config(text = "Error: the replicate must be a whole number from 0")
+            return
+        if self.stream.sampler_of(replicate) is None:
+            self.status_label.config(text = f"Error: replicate {replicate} has not been drawn")
+            return
+        self._show_pair(replicate)
+
+
+    def _show_pair(self, replicate, record = False):
+
+        # Generate the replicate's random data
+        a, b = engine.t_random_pair(parallel.Replicates(self.stream.seed, replicate))
+        self.samples = (a, b)
+        n, mean, var = engine.sample_stats(a, b)
+        if record and self.exporter.writer is not None:
+            self.exporter.writer.write(*engine.t_from_stats(n[0], mean[0], var[0], n[1], mean[1], var[1]), replicate)
 
         # Plot the appropriate values
-        self._update(table_data, a, b)
+        self._update(n, mean, var, replicate)
+
+
+    def _run_1000(self):
+        self._run_batch(1000)
+
+
+    def _run_100000(self):
+        self._run_batch(100000)
+
+
+    def _run_batch(self, runs):
+
+        # Simulate the sample pairs on a background worker
+        self._set_run_state("disabled")
+        self.status_label.config(text = f"Running {runs} T tests...")
+        self.batch_results = []
+        self.next_replicate = self.stream.replicates
+        batches = parallel.run_batches(engine.t_batch, (), runs, self.stream, workers = parallel.default_workers(), sampler = engine.T_SAMPLER)
+        self.worker = BatchWorker(batches).start()
+        self.status_label.after(POLL_MS, self._poll_batch)
+
+
+    def _poll_batch(self):
+        for runs, result in self.worker.poll():
+            if self.exporter.writer is not None:
+                with profiler.phase('export', runs = runs):
+                    self.exporter.writer.write(*result, self.next_replicate + np.arange(runs))
+            self.next_replicate += runs
+            self.batch_results.append(result)
+            profiler.count(runs)
+        if not self.worker.finished:
+            self.status_label.after(POLL_MS, self._poll_batch)
+            return
+
+        self._set_run_state("normal")
+        if self.worker.error is not None:
+            self.status_label.config(text = "Error: the simulation failed")
+        else:
+            self._update_batch(*parallel.merge_results(self.batch_results))
+        self.worker = None
+        self.batch_results = None
+
+
+    def _set_run_state(self, state):
+
+        # Imported data can't be run again, only bootstrapped
+        random_state = "disabled" if self.file_name is not None else state
+        self.run_but.config(state = random_state)
+        self.run_but2.config(state = random_state)
+        self.run_but3.config(state = random_state)
+        self.auto_but.config(state = random_state)
+        if self.file_name is None:
+            self.replay_but.config(state = state)
+        self.boot_but.config(state = state)
 
 
     def _make_screen(self):
@@ -143,66 +294,427 @@ class TPage(DefaultWindow):
         canvas = FigureCanvasTkAgg(self.fig, master = self.frame)
         canvas_widget = canvas.get_tk_widget()
         canvas_widget.pack(fill = tk.BOTH, expand = True)
+        self._make_artists()
+
+        # Make run buttons
+        run_frame = tk.Frame(self.frame, bg = self.bg_color)
+
+        self.run_but = tk.Button(run_frame, text = 'Run', height = 2, font = self.normal_font, command = self._new_random, padx = 10)
+        self.run_but.pack(side = 'left')
+
+        self.run_but2 = tk.Button(run_frame, text = 'Run 1000 times', height = 2, font = self.normal_font, command = self._run_1000, padx = 10)
+        self.run_but2.pack(padx = 20, side = 'left')
+
+        self.run_but3 = tk.Button(run_frame, text = 'Run 100000 times', height = 2, font = self.normal_font, command = self._run_100000, padx = 10)
+        self.run_but3.pack(side = 'left')
+
+        self.auto_but = tk.Button(run_frame, text = 'Auto-run', height = 2, font = self.normal_font, command = self._auto_run, padx = 10)
+        self.auto_but.pack(padx = (20, 0), side = 'left')
 
-        # Make run button
-        self.run_but = tk.Button(self.frame, text = 'Run', height = 2, font = self.normal_font, command = self._new_random, padx = 10)
-        self.run_but.pack(pady = (0, 10))
+        self.boot_but = tk.Button(run_frame, text = f'Bootstrap {BOOTSTRAP_RUNS} times', height = 2, font = self.normal_font, command = self._run_bootstrap, padx = 10)
+        self.boot_but.pack(padx = (20, 0), side = 'left')
+
+        run_frame.pack(pady = (0, 10))
 
         # Make label for the T values
         self.status_label = tk.Label(self.frame, text = "", height = 2, fg = self.fg_color, bg = self.bg_color, font = self.normal_light_font)
-        self.status_label.pack(pady = (0, 20))
+        self.status_label.pack(pady = (0, 10))
+
+        seed_frame = tk.Frame(self.frame, bg = self.bg_color)
+
+        tk.Label(seed_frame, text = f'Seed: {self.stream.seed}', fg = self.fg_color, bg = self.bg_color, font = self.normal_light_font).pack(side = 'left')
+
+        # Only random replicates are exported
+        if self.file_name is None:
+            self.export_but = tk.Button(seed_frame, text = 'Export replicates', font = self.normal_font, command = self._toggle_export, padx = 10)
+            self.export_but.pack(side = 'left', padx = (20, 0))
+
+            # Any replicate can be drawn again on its own
+            tk.Label(seed_frame, text = 'Replicate:', fg = self.fg_color, bg = self.bg_color, font = self.normal_light_font).pack(side = 'left', padx = (20, 5))
+            self.replicate_entry = tk.Entry(seed_frame, width = 10, font = self.normal_light_font)
+            self.replicate_entry.pack(side = 'left')
+            self.replay_but = tk.Button(seed_frame, text = 'Show replicate', font = self.normal_font, command = self._show_replicate, padx = 10)
+            self.replay_but.pack(side = 'left', padx = (5, 0))
+
+        seed_frame.pack(pady = (0, 10))
+
+
+    @timed('t pairs screen', frame = True)
+    def _pairs_screen(self, stats):
+
+        # Clear current screen
+        self.button_frame.destroy()
+        self.error_label.destroy()
+        self.pair_stats = stats
+
+        # Heatmap of the P value of every pair, on a log scale so small values stand apart
+        plt.style.use('fast')
+        self.fig, self.ax = plt.subplots(1, 1)
+        self.fig.patch.set_facecolor(self.bg_color)
+        self.ax.set_title('P values of every pair of columns')
+        columns = len(stats.n)
+        self.pair_image = self.ax.imshow(np.full((columns, columns), np.nan), cmap = 'viridis', norm = LogNorm(vmin = MIN_P_SHOWN, vmax = 1))
+        self.fig.colorbar(self.pair_image, ax = self.ax, label = 'P value')
+        if columns <= MAX_LABELLED_COLUMNS:
+            self.ax.set_xticks(range(columns), stats.names, rotation = 90)
+            self.ax.set_yticks(range(columns), stats.names)
+        canvas = FigureCanvasTkAgg(self.fig, master = self.frame)
+        canvas.get_tk_widget().pack(fill = tk.BOTH, expand = True)
+
+        # Test and correction choices
+        option_frame = tk.Frame(self.frame, bg = self.bg_color)
+
+        tk.Label(option_frame, text = 'Test', bg = self.bg_color, fg = self.fg_color, font = self.normal_light_font).pack(side = 'left')
+        self.test_choice = tk.StringVar(value = 'Student')
+        test_menu = tk.OptionMenu(option_frame, self.test_choice, 'Student', 'Welch', command = lambda value: self._update_pairs())
+        test_menu.config(font = self.normal_font)
+        test_menu.pack(side = 'left', padx = (10, 30))
+
+        tk.Label(option_frame, text = 'Correction', bg = self.bg_color, fg = self.fg_color, font = self.normal_light_font).pack(side = 'left')
+        self.correction_choice = tk.StringVar(value = 'Holm')
+        correction_menu = tk.OptionMenu(option_frame, self.correction_choice, *engine.CORRECTIONS, command = lambda value: self._update_pairs())
+        correction_menu.config(font = self.normal_font)
+        correction_menu.pack(side = 'left', padx = 10)
+
+        option_frame.pack(pady = (0, 10))
+
+        self.status_label = tk.Label(self.frame, text = "", height = 2, fg = self.fg_color, bg = self.bg_color, font = self.normal_light_font)
+        self.status_label.pack(pady = (0, 10))
+
+        self._update_pairs()
 
 
-    def _update(self, table_data, a, b):
+    @timed('t update pairs', frame = True)
+    def _update_pairs(self):
+
+        # Every pair at once from the column statistics
+        stats = self.pair_stats
+        i, j, t, p, dof = engine.pairwise_t(stats.n, stats.mean, stats.var, equal_var = self.test_choice.get() == 'Student')
+        correction = self.correction_choice.get()
+        adjusted = engine.CORRECTIONS[correction](p)
+
+        self.pair_image.set_data(engine.pair_matrix(len(stats.n), i, j, np.maximum(adjusted, MIN_P_SHOWN)))
+        with profiler.phase('draw'):
+            self.fig.canvas.draw()
+
+        # Update the label
+        significant = int((adjusted < ALPHA).sum())
+        smallest = np.nanargmin(adjusted) if not np.isnan(adjusted).all() else None
+        text = f"{significant} of {len(p)} pairs significant at {ALPHA}" + ("" if correction == 'None' else f" after the {correction} correction")
+        if smallest is not None:
+            text += f", smallest P value: {stats.names[i[smallest]]} vs {stats.names[j[smallest]]}, {adjusted[smallest]:.3g}"
+        self.status_label.config(text = text)
+
+
+    def _power_screen(self):
+
+        # Clear current screen
+        self.button_frame.destroy()
+        self.error_label.destroy()
+
+        # Heatmap of power over the grid, and curves for a few effect sizes
+        plt.style.use('fast')
+        self.fig, self.ax = plt.subplots(1, 2)
+        self.fig.patch.set_facecolor(self.bg_color)
+        self.ax[0].set_title('Simulated power')
+        self.ax[0].set_xlabel('Sample size per group')
+        self.ax[0].set_ylabel('Effect size (d)')
+        self.power_image = self.ax[0].imshow(np.full((len(POWER_EFFECTS), len(POWER_SIZES)), np.nan), origin = 'lower', aspect = 'auto', vmin = 0, vmax = 1,
+                                             extent = (POWER_SIZES[0], POWER_SIZES[-1], POWER_EFFECTS[0], POWER_EFFECTS[-1]))
+        self.fig.colorbar(self.power_image, ax = self.ax[0])
+
+        # Exact power as lines, simulated power as points over them
+        self.ax[1].set_facecolor(self.bg_color)
+        self.ax[1].set_title('Power curves')
+        self.ax[1].set_xlabel('Sample size per group')
+        self.ax[1].set_ylim(0, 1.02)
+        self.ax[1].axhline(TARGET_POWER, color = 'grey', ls = ':')
+        exact = engine.t_power(POWER_EFFECTS, POWER_SIZES)
+        self.curve_rows = [int(np.abs(POWER_EFFECTS - effect).argmin()) for effect in CURVE_EFFECTS]
+        self.power_points = []
+        for row in self.curve_rows:
+            line, = self.ax[1].plot(POWER_SIZES, exact[row], label = f'd = {round(POWER_EFFECTS[row], 2)}')
+            points, = self.ax[1].plot(POWER_SIZES, np.full(len(POWER_SIZES), np.nan), 'o', ms = 3, color = line.get_color())
+            self.power_points.append(points)
+        self.ax[1].legend(loc = 'lower right')
+        self.power_exact = exact
+
+        canvas = FigureCanvasTkAgg(self.fig, master = self.frame)
+        canvas.get_tk_widget().pack(fill = tk.BOTH, expand = True)
+
+        # Make run buttons
+        run_frame = tk.Frame(self.frame, bg = self.bg_color)
+
+        self.power_buttons = [tk.Button(run_frame, text = f'Run {runs} per point', height = 2, font = self.normal_font, command = lambda runs = runs: self._run_power(runs), padx = 10)
+                              for runs in (1000, 10000)]
+        for button in self.power_buttons:
+            button.pack(padx = (0, 20), side = 'left')
+
+        self.power_cancel = tk.Button(run_frame, text = 'Cancel', height = 2, font = self.normal_font, command = lambda: self.worker.cancel(), padx = 10, state = tk.DISABLED)
+        self.power_cancel.pack(side = 'left')
+
+        run_frame.pack(pady = (0, 10))
+
+        self.status_label = tk.Label(self.frame, text = "", height = 2, fg = self.fg_color, bg = self.bg_color, font = self.normal_light_font)
+        self.status_label.pack(pady = (0, 10))
+
+        tk.Label(self.frame, text = f'Seed: {self.stream.seed}', fg = self.fg_color, bg = self.bg_color, font = self.normal_light_font).pack(pady = (0, 10))
+
+
+    def _run_power(self, runs):
+
+        # Every batch simulates a few tests at every point of the grid, so the
+        # whole plot sharpens as batches finish
+        for button in self.power_buttons:
+            button.config(state = tk.DISABLED)
+        self.power_cancel.config(state = tk.NORMAL)
+        self.power_rejected = np.zeros((len(POWER_EFFECTS), len(POWER_SIZES)), dtype = np.int64)
+        self.power_runs = 0
+        batches = parallel.run_batches(engine.power_batch, (POWER_EFFECTS, POWER_SIZES), runs, self.stream, workers = parallel.default_workers(), batch_size = POWER_BATCH)
+        self.worker = BatchWorker(batches).start()
+        self.status_label.after(POLL_MS, self._poll_power)
+
+
+    def _poll_power(self):
+        finished = self.worker.poll()
+        for runs, rejected in finished:
+            self.power_rejected += rejected
+            self.power_runs += runs
+            profiler.count(runs * rejected.size)
+        if finished:
+            self._update_power()
+
+        if not self.worker.finished:
+            self.status_label.after(POLL_MS, self._poll_power)
+            return
+
+        for button in self.power_buttons:
+            button.config(state = tk.NORMAL)
+        self.power_cancel.config(state = tk.DISABLED)
+        if self.worker.error is not None:
+            self.status_label.config(text = "Error: the simulation failed")
+        self.worker = None
+
+
+    @timed('t update power', frame = True)
+    def _update_power(self):
+        power = self.power_rejected / self.power_runs
+        self.power_image.set_data(power)
+        for row, points in zip(self.curve_rows, self.power_points):
+            points.set_ydata(power[row])
+        self.fig.canvas.draw_idle()
+
+        # Largest gap to the exact power, which shrinks as 1 / sqrt(runs)
+        gap = np.abs(power - self.power_exact).max()
+        self.status_label.config(text = f"{self.power_runs} tests per point, largest difference from the exact power: {round(gap, 3)}")
+
+
+    def _toggle_export(self):
+        self.exporter.toggle(self.stream.seed, self.export_but, self.status_label)
+
+
+    def _run_bootstrap(self):
+
+        # Resample on a background worker
+        self._set_run_state("disabled")
+        self.status_label.config(text = f"Bootstrapping {BOOTSTRAP_RUNS} times...")
+        self.batch_results = []
+        self.worker = BatchWorker(self._bootstrap_batches(BOOTSTRAP_RUNS)).start()
+        self.status_label.after(POLL_MS, self._poll_bootstrap)
+
+
+    def _bootstrap_batches(self, runs):
+
+        # Imported files are only read in full once a bootstrap needs the values.
+        # The samples stay in this process, as sending them to others for every
+        # batch would cost more than it saves
+        if self.samples is None:
+            with profiler.phase('read columns'):
+                self.samples = tuple(loader.read_columns(self.file_name, columns = 2))
+        yield from parallel.run_batches(bootstrap.resample, self.samples, runs, self.stream, batch_size = BOOTSTRAP_BATCH)
+
+
+    def _poll_bootstrap(self):
+        for runs, result in self.worker.poll():
+            self.batch_results.append(result)
+            profiler.count(runs)
+        if not self.worker.finished:
+            self.status_label.config(text = f"Bootstrapping... {len(self.batch_results) * BOOTSTRAP_BATCH} of {BOOTSTRAP_RUNS}")
+            self.status_label.after(POLL_MS, self._poll_bootstrap)
+            return
+
+        self._set_run_state("normal")
+        if isinstance(self.worker.error, ValueError):
+            self.status_label.config(text = f"Error! {self.worker.error}")
+        elif self.worker.error is not None:
+            self.status_label.config(text = "Error: the bootstrap failed")
+        else:
+            self._update_bootstrap(*parallel.merge_results(self.batch_results))
+        self.worker = None
+        self.batch_results = None
+
+
+    @timed('t update bootstrap', frame = True)
+    def _update_bootstrap(self, difference, ratio):
+        a, b = self.samples
+        results = bootstrap.intervals(a, b, difference, ratio, BOOTSTRAP_LEVEL)
+
+        # Mean differences over the T test's standard error are on the scale of
+        # the T axis, centred on the T value rather than 0
+        if self.boot_bars is not None:
+            self.boot_bars.remove()
+        _, _, self.boot_bars = self.ax[1].hist(difference / bootstrap.standard_error(a, b), bins = 100, density = True, color = 'orange', alpha = 0.5)
+        self.ax[1].autoscale()
+        with profiler.phase('draw'):
+            self.fig.canvas.draw()
+
+        # Update the label
+        lines = [f"{name}: {result['estimate']:.3f}, {round(BOOTSTRAP_LEVEL * 100)}% CI percentile [{result['percentile'][0]:.3f}, {result['percentile'][1]:.3f}], "
+                 f"BCa [{result['bca'][0]:.3f}, {result['bca'][1]:.3f}]" for name, result in results.items()]
+        self.status_label.config(text = '\n'.join(lines))
+
+
+    def _make_artists(self):
+
+        # The lines and tail regions _update moves are animated, so they're
+        # left out of full draws and drawn over a saved background instead
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        self.ax[0].set_title('Data sets (normal distributions)')
+        self.data_lines = [self.ax[0].plot([], [], animated = True)[0] for _ in range(2)]
+        self._make_t_artists()
+
+
+    def _make_t_artists(self):
+        self.ax[1].cla()
+        self.ax[1].set_title('T Distribution')
+        self.t_curve, = self.ax[1].plot([], [], color = self.fg_color, animated = True)
+        self.tails = [self.ax[1].add_patch(Polygon(np.zeros((1, 2)), color = self.fg_color, animated = True)) for _ in range(2)]
+        self.t_line, = self.ax[1].plot([], [], color = 'orange', animated = True)
+        self.t_artists = [self.t_curve, *self.tails, self.t_line]
+        self.background = None
+
+
+    def _on_draw(self, event):
+
+        # Every full draw saves the figure as the background, then adds the moving artists
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+
+    def _draw_artists(self):
+        for artist in self.data_lines + (self.t_artists or []):
+            self.fig.draw_artist(artist)
+
+
+    def _fit_limits(self, ax, left, right, top):
+        '''Sets the limits of a graph around the data once it leaves them or
+        fills too little of them, returning whether they changed'''
+        x_min, x_max = ax.get_xlim()
+        y_max = ax.get_ylim()[1]
+        if (x_min <= left and right <= x_max and top <= y_max
+                and right - left >= LIMIT_FILL * (x_max - x_min) and top >= LIMIT_FILL * y_max):
+            return False
+        margin = LIMIT_MARGIN * (right - left)
+        new_left, new_right, new_top = left - margin, right + margin, top * (1 + LIMIT_MARGIN)
+
+        # Grow the current limits instead while the data overlaps them and would
+        # still fill enough of them, so they settle after a few samples
+        grown_left, grown_right, grown_top = min(x_min, new_left), max(x_max, new_right), max(y_max, new_top)
+        if (left < x_max and x_min < right
+                and right - left >= LIMIT_FILL * (grown_right - grown_left) and top >= LIMIT_FILL * grown_top):
+            new_left, new_right, new_top = grown_left, grown_right, grown_top
+        ax.set_xlim(new_left, new_right)
+        ax.set_ylim(0, new_top)
+        return True
+
+
+    @timed('t update', frame = True)
+    def _update(self, n, mean, var, replicate = None):
 
         # Update table
+        table_data = engine.summary_table(n, mean, var)
         data_flat = iter(table_data.flatten().tolist())
         for row in self.grid:
             for col in row:
                 col.config(text = next(data_flat))
 
-        # Find T and P values
-        t, p = scstats.ttest_ind(a, b)
+        # Bring back the T distribution after a batch, and take off bootstrap bars
+        if self.t_artists is None:
+            self._make_t_artists()
+        if self.boot_bars is not None:
+            self.boot_bars.remove()
+            self.boot_bars = None
+            self.background = None
+
+        # Move both graphs, with the T and P values, and their limits
+        t, p, dof, extents = render.move_t_graphs(self.data_lines, self.t_curve, self.tails, self.t_line, n, mean, var)
+        moved = self._fit_limits(self.ax[0], *extents[0])
+        moved = self._fit_limits(self.ax[1], *extents[1]) or moved
+
+        # Update the graph, only redrawing the moving artists while the limits stay
+        if moved:
+            self.background = None
+        with profiler.phase('draw'):
+            self._blit()
 
-        # Clear graphs and titles
-        self.ax[0].cla()
-        self.ax[1].cla()
+        # Update the label
+        label = f"T value: {round(t, 2)}, P value: {round(p, 2)}, {'Significant' if p < 0.05 else 'Insignificant'}"
+        self.status_label.config(text = label if replicate is None else f"Replicate {replicate}: {label}")
 
-        # Set the titles
-        self.ax[0].set_title('Data sets (normal distributions)')
+
+    def _blit(self):
+
+        # Without a background a full draw is queued, which saves a new one
+        canvas = self.fig.canvas
+        if self.background is None:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        self._draw_artists()
+        canvas.blit(self.fig.bbox)
+
+
+    def _auto_run(self):
+
+        # Stream new random samples until stopped
+        if self.auto_id is not None:
+            self.status_label.after_cancel(self.auto_id)
+            self.auto_id = None
+            self._set_run_state("normal")
+            self.auto_but.config(text = 'Auto-run')
+            return
+        self._set_run_state("disabled")
+        self.auto_but.config(state = "normal", text = 'Stop')
+        self._auto_frame()
+
+
+    @timed('t auto-run frame', frame = True)
+    def _auto_frame(self):
+        start = time.perf_counter()
+        self._new_random()
+        profiler.count(1)
+
+        # Wait out the rest of the frame
+        elapsed = (time.perf_counter() - start) * 1000
+        self.auto_id = self.status_label.after(max(1, int(1000 / AUTO_RUN_FPS - elapsed)), self._auto_frame)
+
+
+    @timed('t update batch', frame = True)
+    def _update_batch(self, t, p, dof):
+
+        # Histogram of the simulated T values
+        self.ax[1].cla()
+        self.boot_bars = None
+        self.t_artists = None
         self.ax[1].set_title('T Distribution')
+        self.ax[1].hist(t, bins = 100, density = True)
 
-        # Plot the left graph
-        mu = a.mean()
-        sigma = np.sqrt(a.var(ddof = 1))
-        x = np.linspace(mu - 3 * sigma, mu + 3 * sigma, 100)
-        self.ax[0].plot(x, scstats.norm.pdf(x, mu, sigma))
-    
-        mu = b.mean()
-        sigma = np.sqrt(b.var(ddof = 1))
-        x = np.linspace(mu - 3 * sigma, mu + 3 * sigma, 100)
-        self.ax[0].plot(x, scstats.norm.pdf(x, mu, sigma))
-
-        # Plot the right graph
-        dof = len(a) + len(b) - 2
-
-        x = np.linspace(scstats.t.ppf(0.001, dof), scstats.t.ppf(0.999, dof), 100)
-        self.ax[1].plot(x, scstats.t.pdf(x, dof), color = self.fg_color)
-    
-        # Plot the tail regions below the right graph
-        x = np.linspace(scstats.t.ppf(0.975, dof), scstats.t.ppf(0.999, dof), 100)
-        self.ax[1].fill_between(x, scstats.t.pdf(x, dof), color = self.fg_color)
-        
-        x = np.linspace(scstats.t.ppf(0.001, dof), scstats.t.ppf(0.025, dof), 100)
-        self.ax[1].fill_between(x, scstats.t.pdf(x, dof), color = self.fg_color)
+        # Theoretical T density, mixed over the degrees of freedom of the runs
+        x = np.linspace(distcache.quantile('t', dof.min(), 0.001), distcache.quantile('t', dof.min(), 0.999), 200)
+        self.ax[1].plot(x, engine.t_mixture_pdf(x, dof), color = self.fg_color)
 
-        # Plot the t value
-        if p >= 0.005 and p <= 0.995:
-            self.ax[1].plot([t, t], [0, scstats.t.pdf(t, dof)], color = 'orange')
-            
         # Update the graph
         self.fig.canvas.draw()
 
         # Update the label
-        self.status_label.config(text = f"T value: {round(t, 2)}, P value: {round(p, 2)}, {'Significant' if p < 0.05 else 'Insignificant'}")            
-            
+        self.status_label.config(text = f"{len(t)} runs, rejection rate at 0.05: {round((p < 0.05).mean(), 3)}")
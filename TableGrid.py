@@ -0,0 +1,175 @@
+import tkinter as tk
+
+import numpy as np
+
+
+class TableGrid:
+    '''TableGrid class for a scrollable table of titles and values drawn on a
+    canvas. Only the cells in view are drawn, and editing moves one Entry over
+    the clicked cell, so big tables don't need a widget for every cell'''
+
+
+    def __init__(self, parent, values, bg, fg, font, title_font, editable = False, max_width = 800, max_height = 240, cell_width = 110, cell_height = 30):
+
+        # Table properties
+        self.bg = bg
+        self.fg = fg
+        self.font = font
+        self.title_font = title_font
+        self.editable = editable
+        self.max_width = max_width
+        self.max_height = max_height
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+
+        # Canvas with scroll bars
+        self.frame = tk.Frame(parent, bg = bg, highlightbackground = fg, highlightthickness = 1)
+        self.canvas = tk.Canvas(self.frame, bg = bg, highlightthickness = 0)
+        x_scroll = tk.Scrollbar(self.frame, orient = tk.HORIZONTAL, command = self._xview)
+        y_scroll = tk.Scrollbar(self.frame, orient = tk.VERTICAL, command = self._yview)
+        self.canvas.configure(xscrollcommand = x_scroll.set, yscrollcommand = y_scroll.set)
+        self.canvas.grid(row = 0, column = 0, sticky = "NSEW")
+        y_scroll.grid(row = 0, column = 1, sticky = "NS")
+        x_scroll.grid(row = 1, column = 0, sticky = "EW")
+
+        # Redraw the cells in view whenever the view changes
+        self.canvas.bind("<Configure>", lambda event: self.redraw())
+        self.canvas.bind("<MouseWheel>", self._wheel)
+        self.canvas.bind("<Shift-MouseWheel>", self._wheel)
+        self.canvas.bind("<Button-4>", self._wheel)
+        self.canvas.bind("<Button-5>", self._wheel)
+
+        # Single entry moved over the cell being edited
+        self.editing = None
+        self.entry = None
+        if editable:
+            self.entry = tk.Entry(self.canvas, bg = bg, font = font, relief = tk.FLAT, justify = tk.CENTER)
+            self.entry.bind("<Return>", lambda event: self._move(1, 0))
+            self.entry.bind("<Tab>", lambda event: self._move(0, 1))
+            self.entry.bind("<Escape>", lambda event: self._stop_editing(save = False))
+            self.entry.bind("<FocusOut>", lambda event: self.canvas.after_idle(self._focus_lost))
+            self.canvas.bind("<Button-1>", self._click)
+
+        self.set_values(values)
+
+
+    def set_values(self, values):
+        self._stop_editing(save = False)
+        self.values = np.asarray(values, dtype = object)
+        rows, cols = self.values.shape
+        self.canvas.configure(width = min(self.max_width, cols * self.cell_width),
+                              height = min(self.max_height, rows * self.cell_height),
+                              scrollregion = (0, 0, cols * self.cell_width, rows * self.cell_height))
+        self.redraw()
+
+
+    def resize(self, rows, cols):
+        '''Changes the number of rows and columns, keeping the values that fit'''
+        self._stop_editing()
+        values = np.full((rows, cols), '', dtype = object)
+        keep_rows = min(rows, self.values.shape[0])
+        keep_cols = min(cols, self.values.shape[1])
+        values[:keep_rows, :keep_cols] = self.values[:keep_rows, :keep_cols]
+        self.set_values(values)
+
+
+    def get(self):
+        '''All values, including any edit in progress'''
+        self._stop_editing()
+        return self.values
+
+
+    def destroy(self):
+        self.frame.destroy()
+
+
+    def redraw(self):
+
+        # Find the cells in view
+        self.canvas.delete("cell")
+        rows, cols = self.values.shape
+        left = self.canvas.canvasx(0)
+        top = self.canvas.canvasy(0)
+        first_col = max(0, int(left // self.cell_width))
+        first_row = max(0, int(top // self.cell_height))
+        last_col = min(cols, int((left + self.canvas.winfo_width()) // self.cell_width) + 1)
+        last_row = min(rows, int((top + self.canvas.winfo_height()) // self.cell_height) + 1)
+
+        # Draw only those
+        for row in range(first_row, last_row):
+            for col in range(first_col, last_col):
+                x = col * self.cell_width
+                y = row * self.cell_height
+                title = row == 0 or col == 0
+                self.canvas.create_rectangle(x, y, x + self.cell_width, y + self.cell_height, outline = "#c8c8c8", fill = self.bg, tags = "cell")
+                self.canvas.create_text(x + self.cell_width / 2, y + self.cell_height / 2, text = str(self.values[row, col]), fill = self.fg,
+                                        font = self.title_font if title else self.font, width = self.cell_width - 4, tags = "cell")
+        self.canvas.tag_raise("editor")
+
+
+    def _xview(self, *args):
+        self.canvas.xview(*args)
+        self.redraw()
+
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self.redraw()
+
+
+    def _wheel(self, event):
+        step = -1 if event.num == 4 or event.delta > 0 else 1
+        if event.state & 0x1:
+            self._xview(tk.SCROLL, step, tk.UNITS)
+        else:
+            self._yview(tk.SCROLL, step, tk.UNITS)
+
+
+    def _click(self, event):
+        row = int(self.canvas.canvasy(event.y) // self.cell_height)
+        col = int(self.canvas.canvasx(event.x) // self.cell_width)
+        self._stop_editing()
+        self._start_editing(row, col)
+
+
+    def _start_editing(self, row, col):
+
+        # The corner cell has no meaning
+        rows, cols = self.values.shape
+        if not (0 <= row < rows and 0 <= col < cols) or (row == 0 and col == 0):
+            return
+
+        self.editing = (row, col)
+        self.canvas.create_window(col * self.cell_width, row * self.cell_height, anchor = tk.NW, window = self.entry,
+                                  width = self.cell_width, height = self.cell_height, tags = "editor")
+        self.entry.delete(0, tk.END)
+        self.entry.insert(tk.END, str(self.values[row, col]))
+        self.entry.select_range(0, tk.END)
+        self.entry.focus_set()
+
+
+    def _stop_editing(self, save = True):
+        if self.editing is None:
+            return
+        if save:
+            self.values[self.editing] = self.entry.get().strip()
+        self.editing = None
+        self.canvas.delete("editor")
+        self.redraw()
+
+
+    def _focus_lost(self):
+
+        # Moving between cells briefly takes the focus off the entry, so only
+        # a click somewhere else ends editing
+        if self.canvas.focus_get() is not self.entry:
+            self._stop_editing()
+
+
+    def _move(self, rows, cols):
+
+        # Save the cell and edit the next one, which is how Return and Tab move
+        row, col = self.editing
+        self._stop_editing()
+        self._start_editing(row + rows, col + cols)
+        return "break"
@@ -0,0 +1,173 @@
+import engine
+import export
+import loader
+import parallel
+import session
+
+import numpy as np
+
+import time
+
+
+def summarise(name, values, p, dof, seconds, seed):
+    '''Printable summary of a batch of simulated statistics'''
+    lines = [f'Runs: {len(values)}',
+             f'Seed: {seed}',
+             f'Degrees of freedom: {dof}',
+             f'Mean {name}: {values.mean():.4f}',
+             f'Median {name}: {np.median(values):.4f}',
+             f'95th percentile {name}: {np.quantile(values, 0.95):.4f}',
+             f'Significant at 0.05: {(p < 0.05).mean():.4f}',
+             f'Time: {seconds:.3f}s ({len(values) / seconds:,.0f} runs/s)']
+    return '\n'.join(lines)
+
+
+def collect(batches, stream, file_name, replicates):
+    '''Merges the results of every batch, streaming each batch's replicates
+    (statistic, p-value, dof and replicate indices) to an export file on the
+    way if one is given'''
+
+    # Batches take their replicates from the stream in order once the first is asked for
+    first = stream.replicates
+    writer = None if file_name is None else export.ReplicateWriter(file_name, stream.seed)
+    results = []
+    try:
+        for runs, result in batches:
+            if writer is not None:
+                writer.write(*replicates(result, first + np.arange(runs)))
+            first += runs
+            results.append(result)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+    return parallel.merge_results(results)
+
+
+def run_chi(args):
+
+    # Get the table to sample from
+    stream = parallel.SeededStream(args.seed)
+    if args.table:
+        data_values, sample_size = session.load_table(args.table)
+    else:
+        data_values, sample_size = engine.random_table(args.random, stream.generator()), 100
+    if args.sample_size:
+        sample_size = args.sample_size
+
+    # Simulate, leaving out the replicates with a 0 row or column
+    table = engine.table_counts(data_values)
+    if args.fixed_margins:
+        job, job_args, sampler, block = engine.chi_fixed_batch, (table,), engine.FIXED_SAMPLER, engine.fixed_margin_block(table.shape)
+    else:
+        job, job_args, sampler, block = engine.chi_batch, (table, sample_size), engine.CHI_SAMPLER, parallel.REPLICATE_BLOCK
+    start = time.perf_counter()
+    batches = parallel.run_batches(job, job_args, args.runs, stream, workers = args.workers, sampler = sampler, block = block)
+    chi2, p, dof, valid = collect(batches, stream, args.export, lambda result, index: (result[0][result[3]], result[1][result[3]], result[2], index[result[3]]))
+    seconds = time.perf_counter() - start
+
+    if args.out:
+        np.save(args.out, chi2[valid])
+    print(f'Skipped (0 row or column): {args.runs - valid.sum()}')
+    print(summarise('chi squared', chi2[valid], p[valid], dof, seconds, stream.seed))
+
+    # Monte Carlo p-value of the table itself
+    if args.fixed_margins:
+        observed = engine.observed_chi2(table)
+        p_mc, se = engine.monte_carlo_p(engine.at_least(chi2[valid], observed).sum(), valid.sum())
+        print(f'Observed chi squared: {observed:.4f}')
+        print(f'Monte Carlo p-value: {p_mc:.4f} ± {se:.4f}, asymptotic p-value: {engine.chi_p_values(observed, dof):.4f}')
+
+
+def run_t(args):
+
+    # Imported data is tested once, random data is simulated
+    if args.csv:
+        stats = loader.read_column_stats(args.csv)
+        n, mean, var = stats.n, stats.mean, stats.var
+        if len(n) < 2:
+            raise ValueError('File must have at least 2 columns')
+        if len(n) > 2:
+            print_pairs(stats, args.welch, args.correction)
+            return
+        t, p, dof = engine.t_from_stats(n[0], mean[0], var[0], n[1], mean[1], var[1], equal_var = not args.welch)
+        print(engine.summary_table(n, mean, var))
+        print(f'T value: {t:.4f}, P value: {p:.4f}, degrees of freedom: {dof:.4g}')
+        return
+
+    stream = parallel.SeededStream(args.seed)
+    start = time.perf_counter()
+    batches = parallel.run_batches(engine.t_batch, (), args.runs, stream, workers = args.workers, sampler = engine.T_SAMPLER)
+    t, p, dof = collect(batches, stream, args.export, lambda result, index: (*result, index))
+    seconds = time.perf_counter() - start
+
+    if args.out:
+        np.save(args.out, t)
+    print(summarise('T', t, p, f'{dof.min()} to {dof.max()}', seconds, stream.seed))
+
+
+def run_render(args):
+
+    # Matplotlib is only imported for this command
+    import render
+    start = time.perf_counter()
+    rendered = 0
+    failed = 0
+    stream = parallel.SeededStream(args.seed)
+    for file_name, out_name, error in render.render_directory(args.directory, args.out, args.format, args.runs, stream, args.seeds, args.workers):
+        if error is None:
+            rendered += 1
+        else:
+            failed += 1
+            print(f'{file_name}: {error}')
+    seconds = time.perf_counter() - start
+    print(f'Rendered {rendered} figures to {args.out} in {seconds:.2f}s ({rendered / seconds:,.1f} figures/s), seed {stream.seed}' + (f', {failed} failed' if failed else ''))
+
+
+def print_pairs(stats, welch, correction, shown = 10):
+    '''Prints the T tests between every pair of columns, smallest P values first'''
+    i, j, t, p, dof = engine.pairwise_t(stats.n, stats.mean, stats.var, equal_var = not welch)
+    adjusted = engine.CORRECTIONS[correction](p)
+    print(f'{len(p)} pairs of {len(stats.n)} columns, {(adjusted < 0.05).sum()} significant at 0.05 ({correction} correction)')
+    for pair in np.argsort(adjusted)[:shown]:
+        print(f'{stats.names[i[pair]]} vs {stats.names[j[pair]]}: T value {t[pair]:.4f}, P value {p[pair]:.4g}, corrected {adjusted[pair]:.4g}')
+
+
+def add_commands(subparsers):
+    '''Adds the headless simulation commands to the main argument parser'''
+
+    chi = subparsers.add_parser('chi', help = 'simulate chi square tests without the UI')
+    source = chi.add_mutually_exclusive_group(required = True)
+    source.add_argument('--table', help = '.session or .stat file saved by the chi square page')
+    source.add_argument('--random', type = int, choices = (2, 3), help = 'use a random 2x2 or 3x3 table')
+    chi.add_argument('--sample-size', type = int, help = 'override the sample size of the table')
+    chi.add_argument('--fixed-margins', action = 'store_true', help = 'simulate tables with the same totals as the table, and give its Monte Carlo p-value')
+    chi.add_argument('--runs', type = int, default = 1000)
+    chi.add_argument('--seed', type = int, help = 'master seed, the same seed gives the same results with any number of workers')
+    chi.add_argument('--workers', type = int, default = parallel.default_workers(), help = 'number of processes to simulate with')
+    chi.add_argument('--out', help = '.npy file for the simulated chi square values')
+    chi.add_argument('--export', help = '.npy, .csv or .parquet file for every replicate with its p-value, degrees of freedom, seed and replicate index, written as batches finish')
+    chi.set_defaults(func = run_chi)
+
+    t = subparsers.add_parser('t', help = 'simulate or run T tests without the UI')
+    t.add_argument('--csv', help = 'CSV file to test instead of random data, every pair of columns is tested if it has more than 2')
+    t.add_argument('--welch', action = 'store_true', help = "use Welch's test, which doesn't assume equal variances")
+    t.add_argument('--correction', choices = tuple(engine.CORRECTIONS), default = 'Holm', help = 'multiple testing correction of the P values of every pair')
+    t.add_argument('--runs', type = int, default = 1000)
+    t.add_argument('--seed', type = int, help = 'master seed, the same seed gives the same results with any number of workers')
+    t.add_argument('--workers', type = int, default = parallel.default_workers(), help = 'number of processes to simulate with')
+    t.add_argument('--out', help = '.npy file for the simulated T values')
+    t.add_argument('--export', help = '.npy, .csv or .parquet file for every replicate with its p-value, degrees of freedom, seed and replicate index, written as batches finish')
+    t.set_defaults(func = run_t)
+
+    render = subparsers.add_parser('render', help = 'save the chi square histogram of every table and the T test graphs of every CSV file in a directory')
+    render.add_argument('directory', help = 'directory of .session, .stat and 2 column .csv files')
+    render.add_argument('--out', default = 'figures', help = 'directory the figures are saved to')
+    render.add_argument('--format', choices = ('png', 'svg', 'pdf'), default = 'png')
+    render.add_argument('--runs', type = int, default = 10000, help = 'chi square tests simulated for each histogram')
+    render.add_argument('--seeds', type = int, default = 1, help = 'figures made of each table, each simulated from its own replicates')
+    render.add_argument('--seed', type = int, help = 'master seed, the same seed gives the same figures with any number of workers')
+    render.add_argument('--workers', type = int, default = parallel.default_workers(), help = 'number of processes to render with')
+    render.set_defaults(func = run_render)
@@ -0,0 +1,319 @@
+'''Benchmarks of the simulation and drawing hot paths, run without a display.
+Figures are drawn with the Agg backend and the Tk widgets of the pages are
+mocked, so the numbers are the cost of the page code itself.
+
+    python benchmarks/hotpaths.py --out before.json
+    python benchmarks/hotpaths.py --baseline before.json
+
+With a baseline every result is compared to it, and the exit status is 1 if
+any got worse by more than the tolerance.'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ChiPage import ChiPage
+from TPage import TPage
+from histogram import Histogram
+from sketch import QuantileSketch
+import distcache
+import engine
+import export
+import loader
+import parallel
+import render
+import session
+
+from matplotlib import pyplot as plt
+import numpy as np
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+# The pages ask for TkAgg when imported, so switch back to drawing off screen
+plt.switch_backend('Agg')
+
+# Table sizes, histogram totals and CSV rows measured, and smaller ones for --quick
+CHI_SIZES = (2, 3, 10)
+TABLE_SIZES = (2, 10, 100)
+UPDATE_RUNS = (0, 10 ** 4, 10 ** 6)
+CSV_ROWS = (10 ** 4, 10 ** 5, 10 ** 6)
+QUICK_CSV_ROWS = (10 ** 3, 10 ** 4)
+SEED = 1
+
+
+def _time(function, repeat, number = 1):
+    '''Median seconds per call over repeat rounds of number calls'''
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        rounds.append((time.perf_counter() - start) / number)
+    return statistics.median(rounds)
+
+
+def _result(value, unit, better):
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def _titles(name, size):
+
+    # Titles can't have numbers in them, so count with letters
+    return [f'{name} {chr(65 + i % 26)}{chr(65 + i // 26)}' for i in range(size)]
+
+
+def _table(size, rng):
+
+    # Square table of counts with titles, like the input page makes
+    counts = rng.integers(50, 150, (size, size)).tolist()
+    return engine.make_table(counts, _titles('Row', size), _titles('Column', size))
+
+
+def chi_page(data_values, sample_size = 100):
+    '''ChiPage with its simulation page set up on an Agg figure and mocked widgets'''
+    page = object.__new__(ChiPage)
+    for name in ('chi_label', 'canvas_widget', 'button_start', 'button_start2', 'button_start3', 'button_start4', 'button_mode', 'button_cancel', 'button_save', 'button_replay', 'progress', 'critical_label'):
+        setattr(page, name, mock.MagicMock())
+    page.stream = parallel.SeededStream(SEED)
+    page.session = None
+    page.exporter = export.ExportControl()
+    page.data_values = data_values
+    page.sample_size = sample_size
+    page.fixed_margins = False
+    page.exceeding = None
+    page.total_runs = 0
+    page.line_shown = True
+    page.fig, page.ax = plt.subplots(1, 2)
+    page.dof = engine.chi_dof(engine.table_counts(data_values).shape)
+    page.histogram = Histogram.for_chi2(page.dof)
+    page.sketch = QuantileSketch()
+    page.bars = page.ax[1].bar(page.histogram.edges, 0, width = page.histogram.width, align = 'edge')
+    page.line_x, page.line_pdf = distcache.curve('chi2', page.dof, distcache.CHI_START, page.histogram.edges[-1])
+    page.line, = page.ax[1].plot(page.line_x, page.line_pdf)
+    page.critical_line = page.ax[1].axvline(0)
+    page.critical_theory = page.ax[1].axvline(0)
+    return page
+
+
+def t_page():
+    '''TPage with its screen set up on an Agg figure and mocked widgets'''
+    page = object.__new__(TPage)
+    page.stream = parallel.SeededStream(SEED)
+    page.fg_color = '#1c1c1c'
+    page.grid = [[mock.MagicMock() for _ in range(3)] for _ in range(4)]
+    page.error_label = mock.MagicMock()
+    page.status_label = mock.MagicMock()
+    page.fig, page.ax = plt.subplots(1, 2)
+    page.boot_bars = None
+    page.exporter = export.ExportControl()
+    page._make_screen = lambda: None
+    page._set_run_state = lambda state: None
+    page._make_artists()
+    return page
+
+
+def _chi_single(page):
+    '''Draws and tests the next replicate as run once does, without the animation'''
+    page.replicate = page.stream.take(1, engine.CHI_SAMPLER).first
+    page.replaying = False
+    sample = engine.chi_tables(engine.table_counts(page.data_values), page.sample_size, 1, parallel.Replicates(page.stream.seed, page.replicate))[0]
+    try:
+        page._chi(sample)
+    except ValueError:
+        pass
+
+
+def bench_chi(sizes, repeat):
+    results = {}
+    rng = np.random.default_rng(SEED)
+    for size in sizes:
+        page = chi_page(_table(size, rng))
+
+        # Run once path, one replicate per call
+        seconds = _time(lambda: _chi_single(page), repeat, number = 200)
+        results[f'chi_single_{size}x{size}'] = _result(1 / seconds, 'replicates/s', 'higher')
+
+        # Batch path behind the run many times buttons
+        table = engine.table_counts(page.data_values)
+        runs = parallel.BATCH_SIZE
+        seconds = _time(lambda: engine.chi_batch(table, page.sample_size, runs, np.random.default_rng(SEED)), repeat)
+        results[f'chi_batch_{size}x{size}'] = _result(runs / seconds, 'replicates/s', 'higher')
+        plt.close(page.fig)
+    return results
+
+
+def bench_make_df(sizes, repeat):
+    results = {}
+    rng = np.random.default_rng(SEED)
+    page = object.__new__(ChiPage)
+    for size in sizes:
+        counts = rng.integers(50, 150, (size, size)).tolist()
+        rows, columns = _titles('Row', size), _titles('Column', size)
+        seconds = _time(lambda: page.make_df(counts, rows, columns), repeat, number = 20)
+        results[f'make_df_{size}x{size}'] = _result(seconds * 1000, 'ms', 'lower')
+    return results
+
+
+def bench_chi_update(totals, repeat):
+    results = {}
+    page = chi_page(_table(2, np.random.default_rng(SEED)))
+    for total in totals:
+
+        # Fill the histogram up to the total, then time one redraw
+        if total > page.histogram.total:
+            chi2, p, dof, valid = engine.chi_batch(engine.table_counts(page.data_values), page.sample_size, total - page.histogram.total, np.random.default_rng(SEED))
+            page.histogram.add(chi2[valid])
+            page.sketch.add(chi2[valid])
+        seconds = _time(page._chi_update, repeat)
+        results[f'chi_update_{total}_runs'] = _result(seconds * 1000, 'ms', 'lower')
+    plt.close(page.fig)
+    return results
+
+
+def bench_t_update(repeat):
+    page = t_page()
+    pairs = [engine.sample_stats(*engine.t_random_pair(page.stream.take(1, engine.T_SAMPLER))) for _ in range(repeat)]
+    frames = iter(pairs * 3)
+    page._update(*next(frames))
+    seconds = _time(lambda: page._update(*next(frames)), repeat)
+
+    # Frames that move the limits, which need a full draw
+    def full_frame():
+        page.background = None
+        page._update(*next(frames))
+    full = _time(full_frame, repeat)
+    plt.close(page.fig)
+    return {'t_update_frame': _result(seconds * 1000, 'ms', 'lower'),
+            't_update_full_frame': _result(full * 1000, 'ms', 'lower')}
+
+
+def _t_import(page, file_name):
+    '''Reads a file the way the import worker does, then shows its statistics'''
+    for read, stats in page._read_file(file_name):
+        pass
+    page._imported(file_name, stats)
+
+
+def bench_t_import(rows_list, repeat):
+    results = {}
+    rng = np.random.default_rng(SEED)
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in rows_list:
+            file_name = os.path.join(directory, f'{rows}.csv')
+            np.savetxt(file_name, rng.normal(100, 15, (rows, 2)), delimiter = ',', fmt = '%.6f')
+            page = t_page()
+            seconds = _time(lambda: _t_import(page, file_name), repeat)
+            tracemalloc.start()
+            _t_import(page, file_name)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            plt.close(page.fig)
+            results[f't_import_{rows}_rows'] = _result(seconds * 1000, 'ms', 'lower')
+            results[f't_import_{rows}_rows_peak'] = _result(peak / 2 ** 20, 'MiB', 'lower')
+    return results
+
+
+def bench_chi_import(rows_list, repeat):
+    '''Counting the contingency table of long format files, a row per individual'''
+    results = {}
+    rng = np.random.default_rng(SEED)
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in rows_list:
+            file_name = os.path.join(directory, f'{rows}.csv')
+            ages = np.array(['18-24', '25-34', '35-44', '45+'])[rng.integers(0, 4, rows)]
+            answers = np.array(['Yes', 'No', 'Unsure'])[rng.integers(0, 3, rows)]
+            np.savetxt(file_name, np.column_stack((ages, answers)), delimiter = ',', fmt = '%s', header = 'age,answer', comments = '')
+            seconds = _time(lambda: loader.read_contingency(file_name), repeat)
+            tracemalloc.start()
+            loader.read_contingency(file_name)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[f'chi_import_{rows}_rows'] = _result(seconds * 1000, 'ms', 'lower')
+            results[f'chi_import_{rows}_rows_peak'] = _result(peak / 2 ** 20, 'MiB', 'lower')
+    return results
+
+
+def bench_render(repeat):
+    '''Figures per second of the render command in one process, after the
+    templates are made'''
+    results = {}
+    rng = np.random.default_rng(SEED)
+    with tempfile.TemporaryDirectory() as directory:
+        session.Session.create(os.path.join(directory, 'table.session'), session.make_header(_table(3, rng), 100))
+        np.savetxt(os.path.join(directory, 'data.csv'), rng.normal(100, 15, (50, 2)), delimiter = ',')
+        jobs = render.make_jobs(directory, directory, stream = parallel.SeededStream(SEED))
+        for job in jobs:
+            render.render_job(job)
+            seconds = _time(lambda: render.render_job(job), repeat)
+            results[f'render_{job[0]}_figure'] = _result(1 / seconds, 'figures/s', 'higher')
+    return results
+
+
+def run(quick = False, repeat = 5):
+    results = {}
+    results.update(bench_chi(CHI_SIZES, repeat))
+    results.update(bench_make_df(TABLE_SIZES, repeat))
+    results.update(bench_chi_update(UPDATE_RUNS[:2] if quick else UPDATE_RUNS, repeat))
+    results.update(bench_t_update(repeat))
+    results.update(bench_t_import(QUICK_CSV_ROWS if quick else CSV_ROWS, 1 if quick else 3))
+    results.update(bench_chi_import(QUICK_CSV_ROWS if quick else CSV_ROWS, 1 if quick else 3))
+    results.update(bench_render(repeat))
+    return {'python': sys.version.split()[0], 'numpy': np.__version__, 'cpus': os.cpu_count(), 'results': results}
+
+
+def compare(results, baseline, tolerance):
+    '''Prints each result against the baseline, returning the names of those
+    that got worse by more than the tolerance'''
+    regressions = []
+    for name, result in results['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f'{name:<32}{result["value"]:>14.3f} {result["unit"]:<13} (new)')
+            continue
+
+        # Speed-up is above 1 when the new result is better
+        if result['better'] == 'higher':
+            speedup = result['value'] / old['value'] if old['value'] else float('inf')
+        else:
+            speedup = old['value'] / result['value'] if result['value'] else float('inf')
+        worse = speedup < 1 - tolerance
+        if worse:
+            regressions.append(name)
+        print(f'{name:<32}{old["value"]:>14.3f} -> {result["value"]:<14.3f}{result["unit"]:<13}{speedup:6.2f}x{"  REGRESSION" if worse else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the simulation and drawing hot paths')
+    parser.add_argument('--out', help = 'JSON file to write the results to')
+    parser.add_argument('--baseline', help = 'JSON file of earlier results to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'fraction a result may get worse by before it counts as a regression')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'rounds per measurement, the median is reported')
+    parser.add_argument('--quick', action = 'store_true', help = 'smaller sizes, for a fast check')
+    args = parser.parse_args()
+
+    results = run(args.quick, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+            sys.exit(1)
+    elif not args.out:
+        print(json.dumps(results, indent = 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''Cold start benchmark. Reports the import time of each top level package
+for the menu and for the pages, the time until the menu window is drawn,
+and how long the pages take to import afterwards. Every measurement runs in a new
+Python process, so nothing is already imported.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 10 --json'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that should only be imported once a page is needed
+HEAVY = ('numpy', 'pandas', 'scipy', 'matplotlib')
+
+FIRST_WINDOW = '''
+import time
+start = time.perf_counter()
+import json, sys
+import tkinter as tk
+from MainPage import MainPage
+imported = time.perf_counter()
+result = {'import_ms': (imported - start) * 1000,
+          'heavy_loaded': sorted({name.split('.')[0] for name in sys.modules} & set(%r))}
+try:
+    root = tk.Tk()
+    root.withdraw()
+    MainPage(root)
+    root.update_idletasks()
+    result['window_ms'] = (time.perf_counter() - start) * 1000
+    root.destroy()
+except tk.TclError as e:
+    result['window_ms'] = None
+    result['error'] = str(e)
+print(json.dumps(result))
+''' % (HEAVY,)
+
+PAGES = '''
+import time
+start = time.perf_counter()
+import ChiPage, TPage
+print((time.perf_counter() - start) * 1000)
+'''
+
+
+def _python(*args):
+    return subprocess.run([sys.executable, *args], cwd = ROOT, capture_output = True, text = True, check = True)
+
+
+def import_breakdown(modules):
+    '''Self import time in ms of each top level package imported by modules
+    (a comma separated list), from python -X importtime'''
+    totals = {}
+    for line in _python('-X', 'importtime', '-c', f'import {modules}').stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(self_us) / 1000
+    return dict(sorted(totals.items(), key = lambda item: -item[1]))
+
+
+def first_window():
+    return json.loads(_python('-c', FIRST_WINDOW).stdout)
+
+
+def page_imports():
+    return float(_python('-c', PAGES).stdout)
+
+
+def run(repeat, top):
+    windows = [first_window() for _ in range(repeat)]
+    drawn = [result['window_ms'] for result in windows if result['window_ms'] is not None]
+    menu = import_breakdown('main')
+    pages = import_breakdown('main, ChiPage, TPage')
+    return {'python': sys.version.split()[0],
+            'repeat': repeat,
+            'menu_import_ms': statistics.median(result['import_ms'] for result in windows),
+            'first_window_ms': statistics.median(drawn) if drawn else None,
+            'window_error': windows[0].get('error'),
+            'heavy_loaded_at_menu': windows[0]['heavy_loaded'],
+            'page_import_ms': statistics.median(page_imports() for _ in range(repeat)),
+            'menu_import_breakdown_ms': dict(list(menu.items())[:top]),
+            'page_import_breakdown_ms': dict(list(pages.items())[:top])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure the cold start of the program')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'new processes per measurement, the median is reported')
+    parser.add_argument('--top', type = int, default = 15, help = 'packages listed in the import breakdown')
+    parser.add_argument('--json', action = 'store_true', help = 'print the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.top)
+    if args.json:
+        print(json.dumps(results, indent = 2))
+        return
+
+    print(f'Menu import: {results["menu_import_ms"]:.1f} ms')
+    if results['first_window_ms'] is None:
+        print(f'First window: not measured ({results["window_error"]})')
+    else:
+        print(f'First window: {results["first_window_ms"]:.1f} ms')
+    print(f'Heavy libraries loaded before the menu: {", ".join(results["heavy_loaded_at_menu"]) or "none"}')
+    print(f'Page imports afterwards: {results["page_import_ms"]:.1f} ms')
+    for name, key in (('the menu', 'menu_import_breakdown_ms'), ('the menu and pages', 'page_import_breakdown_ms')):
+        print(f'Import time of {name} by package:')
+        for package, ms in results[key].items():
+            print(f'  {package:<24}{ms:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import numpy as np
+from scipy import special
+
+
+# Memory the resampled values of one chunk may take, in bytes
+MEMORY_BUDGET = 64 * 2 ** 20
+
+# Statistics of two samples that intervals are given for
+STATISTICS = ('Mean difference', 'Variance ratio')
+
+
+def chunk_size(n, budget = MEMORY_BUDGET):
+    '''Resamples per chunk so that the indices and values drawn for a sample
+    of n values (8 bytes each) stay within the memory budget'''
+    return max(1, int(budget // (16 * n)))
+
+
+def _resampled_stats(sample, runs, rng, budget):
+    '''Mean and sample variance of runs resamples of one sample, drawn a
+    chunk at a time rather than as one (runs, n) matrix'''
+    mean = np.empty(runs)
+    var = np.empty(runs)
+    block = chunk_size(len(sample), budget)
+    for start in range(0, runs, block):
+        stop = min(start + block, runs)
+        values = sample[rng.integers(0, len(sample), size = (stop - start, len(sample)))]
+        mean[start:stop] = values.mean(axis = 1)
+        var[start:stop] = values.var(axis = 1, ddof = 1)
+    return mean, var
+
+
+def resample(a, b, runs, rng, budget = MEMORY_BUDGET):
+    '''Mean differences and variance ratios of runs bootstrap resamples of the
+    two samples, each sample resampled on its own'''
+    mean_a, var_a = _resampled_stats(a, runs, rng, budget)
+    mean_b, var_b = _resampled_stats(b, runs, rng, budget)
+    return mean_a - mean_b, var_a / var_b
+
+
+def estimates(a, b):
+    '''Mean difference and variance ratio of the samples themselves'''
+    return np.array([a.mean() - b.mean(), a.var(ddof = 1) / b.var(ddof = 1)])
+
+
+def standard_error(a, b):
+    '''Pooled standard error of the mean difference, as the Student T test uses'''
+    n_a, n_b = len(a), len(b)
+    pooled = ((n_a - 1) * a.var(ddof = 1) + (n_b - 1) * b.var(ddof = 1)) / (n_a + n_b - 2)
+    return np.sqrt(pooled * (1 / n_a + 1 / n_b))
+
+
+def _leave_one_out(sample):
+    '''Mean and sample variance of the sample with each value left out in
+    turn, from the deviations from the sample's mean. Leaving out a value
+    with deviation d moves the mean by -d / (n - 1), so the sum of squared
+    deviations becomes the total less d ** 2 * n / (n - 1). Working with
+    deviations keeps the precision when the mean is large next to the spread'''
+    n = len(sample)
+    deviation = sample - sample.mean()
+    squares = (deviation ** 2).sum()
+    mean = sample.mean() - deviation / (n - 1)
+    var = (squares - deviation ** 2 * n / (n - 1)) / (n - 2)
+    return mean, var
+
+
+def jackknife(a, b):
+    '''Jackknife values of both statistics, leaving out each value of either
+    sample in turn, as a (2, len(a) + len(b)) array'''
+    mean_a, var_a = _leave_one_out(a)
+    mean_b, var_b = _leave_one_out(b)
+    difference = np.concatenate((mean_a - b.mean(), a.mean() - mean_b))
+    ratio = np.concatenate((var_a / b.var(ddof = 1), a.var(ddof = 1) / var_b))
+    return np.array([difference, ratio])
+
+
+def acceleration(jackknife_values):
+    '''BCa acceleration from the skewness of the jackknife values'''
+    deviation = jackknife_values.mean() - jackknife_values
+    return (deviation ** 3).sum() / (6 * ((deviation ** 2).sum()) ** 1.5)
+
+
+def percentile_interval(boot, level = 0.95):
+    return tuple(np.quantile(boot, [(1 - level) / 2, (1 + level) / 2]))
+
+
+def bca_interval(boot, estimate, jackknife_values, level = 0.95):
+    '''Bias corrected and accelerated interval, which moves the percentiles
+    for the bias and skewness of the bootstrap distribution'''
+
+    # Bias, from how many resamples fall below the estimate (ties count half)
+    below = ((boot < estimate).sum() + 0.5 * (boot == estimate).sum()) / len(boot)
+    bias = special.ndtri(np.clip(below, 1 / len(boot), 1 - 1 / len(boot)))
+    accel = acceleration(jackknife_values)
+
+    z = special.ndtri(np.array([(1 - level) / 2, (1 + level) / 2]))
+    adjusted = special.ndtr(bias + (bias + z) / (1 - accel * (bias + z)))
+    return tuple(np.quantile(boot, adjusted))
+
+
+def intervals(a, b, boot_difference, boot_ratio, level = 0.95):
+    '''Estimate, percentile interval and BCa interval of each statistic, by name'''
+    values = jackknife(a, b)
+    result = {}
+    for name, estimate, boot, jack in zip(STATISTICS, estimates(a, b), (boot_difference, boot_ratio), values):
+        result[name] = {'estimate': estimate,
+                        'percentile': percentile_interval(boot, level),
+                        'bca': bca_interval(boot, estimate, jack, level)}
+    return result
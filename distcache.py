@@ -0,0 +1,85 @@
+import numpy as np
+from scipy import stats as scstats
+
+from functools import lru_cache
+import threading
+
+
+# Most curves and quantiles kept before the least recently used are dropped
+CACHE_SIZE = 1024
+
+DISTRIBUTIONS = {'t': scstats.t, 'chi2': scstats.chi2}
+
+# Curves the pages draw, warmed in the background for the dof they use most.
+# T curves are given as quantile ranges, chi square curves as x ranges
+T_CURVES = ((0.001, 0.999), (0.975, 0.999), (0.001, 0.025))
+T_WARM_DOF = range(38, 119)
+CHI_START = 0.01
+CHI_QUANTILE = 0.999
+CHI_WARM_DOF = range(1, 17)
+POINTS = 100
+
+_warmed = False
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def _quantile(dist, dof, q):
+    return float(DISTRIBUTIONS[dist].ppf(q, dof))
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def _curve(dist, dof, start, stop, points):
+    x = np.linspace(start, stop, points)
+    y = DISTRIBUTIONS[dist].pdf(x, dof)
+    x.flags.writeable = False
+    y.flags.writeable = False
+    return x, y
+
+
+def _key(dof):
+
+    # Integer dof from NumPy and Python should share one cache entry
+    return int(dof) if float(dof).is_integer() else float(dof)
+
+
+def quantile(dist, dof, q):
+    '''Cached ppf of a distribution ('t' or 'chi2') with dof degrees of freedom'''
+    return _quantile(dist, _key(dof), float(q))
+
+
+def curve(dist, dof, start, stop, points = POINTS):
+    '''Cached x and pdf arrays (read only) of a distribution on an evenly
+    spaced grid from start to stop'''
+    return _curve(dist, _key(dof), float(start), float(stop), points)
+
+
+def quantile_curve(dist, dof, lower, upper, points = POINTS):
+    '''Cached x and pdf arrays between the lower and upper quantiles'''
+    return curve(dist, dof, quantile(dist, dof, lower), quantile(dist, dof, upper), points)
+
+
+def counters():
+    '''Hits, misses and size of the quantile and curve caches'''
+    return {name: function.cache_info()._asdict() for name, function in (('quantile', _quantile), ('curve', _curve))}
+
+
+def clear():
+    _quantile.cache_clear()
+    _curve.cache_clear()
+
+
+def _warm():
+    for dof in T_WARM_DOF:
+        for lower, upper in T_CURVES:
+            quantile_curve('t', dof, lower, upper)
+    for dof in CHI_WARM_DOF:
+        curve('chi2', dof, CHI_START, quantile('chi2', dof, CHI_QUANTILE))
+
+
+def warm_in_background():
+    '''Fills the caches with the curves the pages use most on a background
+    thread, once per process'''
+    global _warmed
+    if not _warmed:
+        _warmed = True
+        threading.Thread(target = _warm, daemon = True).start()
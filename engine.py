@@ -0,0 +1,390 @@
+from profiling import profiler
+import parallel
+
+import numpy as np
+import pandas as pd
+from scipy import special
+from scipy import stats as scstats
+
+
+# Number of table cells (or sample values) simulated at once, so the
+# replicates per block shrink as tables get bigger and memory stays bounded
+BLOCK_CELLS = 2 ** 18
+
+# Names of the samplers replicates are drawn with, kept by parallel.SeededStream
+# so a replicate is drawn again the way it was made
+CHI_SAMPLER = 'chi sample'
+FIXED_SAMPLER = 'chi fixed margins'
+T_SAMPLER = 't pair'
+
+# Replicates drawn at once for each counter block of fixed margin tables, in
+# multiples of parallel.REPLICATE_BLOCK. Their cells are drawn in a Python
+# loop, so blocks are as big as memory allows, up to a size that's still
+# quick to draw again for one replicate
+MAX_FIXED_BLOCK = 4096
+
+
+def chi_dof(shape):
+    '''Degrees of freedom of a chi square test on a table of the given shape'''
+    return (shape[0] - 1) * (shape[1] - 1)
+
+
+def chi_p_values(chi2, dof):
+    '''Upper tail p-values of chi square statistics'''
+
+    # scipy's survival function is very slow for a single degree of freedom,
+    # which every 2x2 table has, so that case uses the closed form instead
+    if dof == 1:
+        return special.erfc(np.sqrt(chi2 / 2))
+    return scstats.chi2.sf(chi2, dof)
+
+
+def chi_statistics(tables):
+    '''Pearson chi square statistics for a stack of (runs, rows, cols) tables,
+    returning the statistics and a mask of which tables had no empty margins'''
+
+    # Margins of every table at once
+    tables = tables.astype(np.float64)
+    row_totals = tables.sum(axis = 2)
+    col_totals = tables.sum(axis = 1)
+    totals = row_totals.sum(axis = 1)
+    valid = (row_totals > 0).all(axis = 1) & (col_totals > 0).all(axis = 1)
+
+    # Pearson's statistic rewritten as N * (sum(O^2 / (R * C)) - 1), which avoids
+    # building the expected tables. Tables with an empty row or column have zero
+    # expected counts, so they are masked out instead of tested
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ratio = (tables ** 2 / (row_totals[:, :, None] * col_totals[:, None, :])).sum(axis = (1, 2))
+    chi2 = np.where(valid, np.maximum(totals * (ratio - 1), 0), np.nan)
+    return chi2, valid
+
+
+def fixed_margin_block(shape):
+    '''Replicates per counter block of fixed margin tables of the given shape'''
+    tables = BLOCK_CELLS // (shape[0] * shape[1]) // parallel.REPLICATE_BLOCK * parallel.REPLICATE_BLOCK
+    return min(max(tables, parallel.REPLICATE_BLOCK), MAX_FIXED_BLOCK)
+
+
+def _chunks(rng, runs, size):
+    '''(start, stop) of the chunks runs are simulated in, about size at a
+    time. Chunks of a Replicates range end on its block boundaries'''
+    if isinstance(rng, np.random.Generator):
+        return [(start, min(start + size, runs)) for start in range(0, runs, size)]
+    return rng.chunks(runs, size)
+
+
+def _draw(rng, start, runs, sample):
+    '''sample(runs, rng) from a generator, drawn in order, or for the
+    replicates start onwards of a parallel.Replicates range'''
+    if isinstance(rng, np.random.Generator):
+        return sample(runs, rng)
+    return rng.draw(start, runs, sample)
+
+
+def chi_tables(table, sample_size, runs, rng, start = 0):
+    '''(runs, rows, cols) tables of samples of sample_size from the
+    proportions of table, from replicate start on if rng is a Replicates range'''
+    table = np.asarray(table, dtype = np.float64)
+    probabilities = table.flatten() / table.sum()
+    tables = _draw(rng, start, runs, lambda n, block_rng: block_rng.multinomial(sample_size, probabilities, size = n))
+    return tables.reshape(runs, *table.shape)
+
+
+def chi_batch(table, sample_size, runs, rng):
+    '''Simulate runs samples of sample_size from the proportions of table,
+    returning the chi square statistics, p-values, degrees of freedom and
+    a mask of the replicates that could be tested'''
+
+    table = np.asarray(table, dtype = np.float64)
+    dof = chi_dof(table.shape)
+
+    chi2 = np.empty(runs)
+    valid = np.empty(runs, dtype = bool)
+
+    # Draw and test the tables a block at a time to bound memory use
+    for start, stop in _chunks(rng, runs, max(1, BLOCK_CELLS // table.size)):
+        with profiler.phase('sample', runs = stop - start):
+            tables = chi_tables(table, sample_size, stop - start, rng, start)
+        with profiler.phase('chi statistic', runs = stop - start):
+            chi2[start:stop], valid[start:stop] = chi_statistics(tables)
+
+    with profiler.phase('p-value', runs = runs):
+        p = chi_p_values(chi2, dof)
+    return chi2, p, dof, valid
+
+
+def fixed_margin_tables(row_totals, col_totals, runs, rng):
+    '''(runs, rows, cols) random tables with the given row and column totals,
+    as drawn when rows are assigned to columns at random. Each cell is drawn
+    from the hypergeometric distribution given the cells before it, for every
+    table at once'''
+
+    rows, cols = len(row_totals), len(col_totals)
+    tables = np.empty((runs, rows, cols), dtype = np.int64)
+    col_left = np.tile(np.asarray(col_totals, dtype = np.int64), (runs, 1))
+
+    for i in range(rows - 1):
+
+        # Share the row out over the columns, each cell against the columns after it
+        row_left = np.full(runs, row_totals[i], dtype = np.int64)
+        rest = col_left.sum(axis = 1)
+        for j in range(cols - 1):
+            rest = rest - col_left[:, j]
+            cell = rng.hypergeometric(col_left[:, j], rest, row_left)
+            tables[:, i, j] = cell
+            row_left -= cell
+            col_left[:, j] -= cell
+        tables[:, i, -1] = row_left
+        col_left[:, -1] -= row_left
+
+    # The last row is whatever is left of each column
+    tables[:, -1, :] = col_left
+    return tables
+
+
+def chi_fixed_tables(table, runs, rng, start = 0):
+    '''(runs, rows, cols) random tables with the same totals as table, from
+    replicate start on if rng is a Replicates range'''
+    table = np.asarray(table, dtype = np.int64)
+    return _draw(rng, start, runs, lambda n, block_rng: fixed_margin_tables(table.sum(axis = 1), table.sum(axis = 0), n, block_rng))
+
+
+def chi_fixed_batch(table, runs, rng):
+    '''Simulate runs random tables with the same row and column totals as
+    table, returning the same values as chi_batch'''
+
+    table = np.asarray(table, dtype = np.int64)
+    dof = chi_dof(table.shape)
+    chi2 = np.empty(runs)
+    valid = np.empty(runs, dtype = bool)
+
+    for start, stop in _chunks(rng, runs, max(1, BLOCK_CELLS // table.size)):
+        with profiler.phase('sample fixed margins', runs = stop - start):
+            tables = chi_fixed_tables(table, stop - start, rng, start)
+        with profiler.phase('chi statistic', runs = stop - start):
+            chi2[start:stop], valid[start:stop] = chi_statistics(tables)
+
+    return chi2, chi_p_values(chi2, dof), dof, valid
+
+
+def observed_chi2(table):
+    '''Chi square statistic of a single table'''
+    chi2, valid = chi_statistics(np.asarray(table)[None])
+    if not valid[0]:
+        raise ValueError('Table has a 0 row or column')
+    return chi2[0]
+
+
+def monte_carlo_p(exceeding, runs):
+    '''Monte Carlo p-value and its standard error, from the number of the
+    runs simulated tables at least as extreme as the observed one. The
+    observed table counts as one of the tables, so p is never 0'''
+    p = (exceeding + 1) / (runs + 1)
+    return p, np.sqrt(p * (1 - p) / (runs + 1))
+
+
+def at_least(chi2, observed):
+    '''Mask of statistics at least as large as observed, allowing for
+    rounding so tables equal to the observed one are counted'''
+    return chi2 >= observed * (1 - 64 * np.finfo(float).eps)
+
+
+def make_table(data, rows, columns):
+    '''Labelled table of counts with row and column totals, laid out as the
+    object array the chi square page displays'''
+    df = pd.DataFrame.from_records(data, index = rows, columns = columns)
+    df.loc['Total'] = df.sum(numeric_only=True, axis=0)
+    df.loc[:,'Total'] = df.sum(numeric_only=True, axis=1)
+    data_values = df.reset_index().T.reset_index().T.to_numpy(copy = True)
+    data_values[0, 0] = ''
+    return data_values
+
+
+def table_counts(data_values):
+    '''Counts of a labelled table, without its titles and totals'''
+    return data_values[1:-1, 1:-1].astype(np.int64)
+
+
+def random_table(size, rng):
+    '''Labelled classroom example table of the given size (2 or 3), with
+    counts close enough to even that the null hypothesis holds'''
+    if size == 2:
+        data = rng.integers(211, 226, size = (2, 2))
+        columns = ["Democrats", "Republicans"]
+        rows = ["Men", "Women"]
+    else:
+        data = rng.integers(94, 101, size = (3, 3))
+        columns = ["Democrats", "Republicans", "Independent"]
+        rows = ["Men", "Women", "Undeclared"]
+    return make_table(data.tolist(), rows, columns)
+
+
+def _t_samples(runs, rng):
+    '''Sizes, shifts and padded samples of runs random sample pairs'''
+    size_a = rng.integers(20, 61, size = runs)
+    size_b = rng.integers(20, 61, size = runs)
+    shift = rng.integers(-4, 5, size = runs)
+    return size_a, size_b, shift, rng.normal(loc = 50, scale = 5, size = (runs, 60)), rng.normal(loc = 50, scale = 5, size = (runs, 60))
+
+
+def t_random_pair(rng):
+    '''Two random normal samples of 20 to 60 elements, the second shifted by
+    up to 4 so that some pairs differ significantly. From a Replicates range
+    it's the pair of its first replicate, the same as t_batch makes'''
+    size_a, size_b, shift, a, b = _draw(rng, 0, 1, _t_samples)
+    return a[0, :size_a[0]], b[0, :size_b[0]] + shift[0]
+
+
+def sample_stats(a, b):
+    '''Size, mean and sample variance of two samples, as arrays'''
+    return (np.array([len(a), len(b)]),
+            np.array([a.mean(), b.mean()]),
+            np.array([a.var(ddof = 1), b.var(ddof = 1)]))
+
+
+def summary_table(n, mean, var):
+    '''Summary table of two samples as shown on the T test page'''
+    return np.array([["", "Data A", "Data B"],
+                     ["Mean", round(mean[0], 2), round(mean[1], 2)],
+                     ["Variance", round(var[0], 2), round(var[1], 2)],
+                     ["Elements", n[0], n[1]]])
+
+
+def t_from_stats(n1, mean1, var1, n2, mean2, var2, equal_var = True):
+    '''T values, two sided P values and degrees of freedom of independent T
+    tests given the size, mean and sample variance of each sample. Works
+    elementwise on arrays, so any number of tests are done at once'''
+
+    if equal_var:
+        dof = n1 + n2 - 2
+        pooled = ((n1 - 1) * var1 + (n2 - 1) * var2) / dof
+        se = np.sqrt(pooled * (1 / n1 + 1 / n2))
+    else:
+        se1 = var1 / n1
+        se2 = var2 / n2
+        dof = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+        se = np.sqrt(se1 + se2)
+
+    t = (mean1 - mean2) / se
+    p = 2 * special.stdtr(dof, -np.abs(t))
+    return t, p, dof
+
+
+def pairwise_t(n, mean, var, equal_var = True):
+    '''T tests between every pair of columns from their size, mean and sample
+    variance, returning the column indices i < j of each pair with its T
+    value, P value and degrees of freedom'''
+    i, j = np.triu_indices(len(n), 1)
+    t, p, dof = t_from_stats(n[i], mean[i], var[i], n[j], mean[j], var[j], equal_var = equal_var)
+    return i, j, t, p, dof
+
+
+def holm(p):
+    '''Holm step-down adjusted P values, controlling the family-wise error rate'''
+    p = np.asarray(p, dtype = np.float64)
+    order = np.argsort(p)
+    adjusted = np.maximum.accumulate(p[order] * (len(p) - np.arange(len(p))))
+    result = np.empty_like(p)
+    result[order] = np.minimum(adjusted, 1)
+    return result
+
+
+def benjamini_hochberg(p):
+    '''Benjamini-Hochberg adjusted P values, controlling the false discovery rate'''
+    p = np.asarray(p, dtype = np.float64)
+    order = np.argsort(p)
+    scaled = p[order] * len(p) / np.arange(1, len(p) + 1)
+    adjusted = np.minimum.accumulate(scaled[::-1])[::-1]
+    result = np.empty_like(p)
+    result[order] = np.minimum(adjusted, 1)
+    return result
+
+
+# P value corrections by the name shown on the T test page
+CORRECTIONS = {'None': lambda p: p, 'Holm': holm, 'Benjamini-Hochberg': benjamini_hochberg}
+
+
+def pair_matrix(columns, i, j, values):
+    '''Symmetric columns x columns matrix of pair values, NaN on the diagonal'''
+    matrix = np.full((columns, columns), np.nan)
+    matrix[i, j] = values
+    matrix[j, i] = values
+    return matrix
+
+
+def power_batch(effects, sizes, runs, rng, alpha = 0.05):
+    '''Number of runs simulated Student T tests that reject at alpha, for
+    every pair of effect size (difference in means over the standard
+    deviation) and sample size per group, as an (effects, sizes) array.
+    Each test is drawn from its sufficient statistics rather than its
+    samples: the difference in means is normal and the pooled variance a
+    scaled chi square, so a test costs the same at any sample size'''
+
+    effects = np.asarray(effects, dtype = np.float64)[:, None]
+    sizes = np.asarray(sizes, dtype = np.float64)[None, :]
+    dof = 2 * sizes - 2
+    critical = special.stdtrit(dof, 1 - alpha / 2)
+    rejected = np.zeros((effects.shape[0], sizes.shape[1]), dtype = np.int64)
+
+    # Blocks of runs for the whole grid, to bound memory
+    block = max(1, BLOCK_CELLS * 4 // rejected.size)
+    for start in range(0, runs, block):
+        shape = (min(block, runs - start),) + rejected.shape
+        difference = effects + rng.standard_normal(shape) * np.sqrt(2 / sizes)
+        pooled = rng.chisquare(np.broadcast_to(dof, shape)) / dof
+        t = difference / np.sqrt(pooled * 2 / sizes)
+
+        # Comparing against the critical value skips the P value of every test
+        rejected += (np.abs(t) > critical).sum(axis = 0)
+
+    return rejected
+
+
+def t_power(effects, sizes, alpha = 0.05):
+    '''Exact power of the two sided Student T test from the noncentral T
+    distribution, as an (effects, sizes) array'''
+    effects = np.asarray(effects, dtype = np.float64)[:, None]
+    sizes = np.asarray(sizes, dtype = np.float64)[None, :]
+    dof = 2 * sizes - 2
+    critical = special.stdtrit(dof, 1 - alpha / 2)
+    noncentrality = effects * np.sqrt(sizes / 2)
+
+    # The far tail underflows to NaN for big effects, where it is 0
+    far_tail = np.nan_to_num(special.nctdtr(dof, noncentrality, -critical))
+    return far_tail + 1 - special.nctdtr(dof, noncentrality, critical)
+
+
+def _masked_stats(samples, sizes):
+    '''Mean and sample variance of each row of a padded block of samples,
+    using only the first sizes[i] values of row i'''
+    mask = np.arange(samples.shape[1]) < sizes[:, None]
+    mean = np.where(mask, samples, 0).sum(axis = 1) / sizes
+    var = np.where(mask, (samples - mean[:, None]) ** 2, 0).sum(axis = 1) / (sizes - 1)
+    return mean, var
+
+
+def t_batch(runs, rng):
+    '''T and P values and degrees of freedom of runs random sample pairs, made
+    the same way as t_random_pair. The samples are drawn as a padded block of
+    the largest size and masked down to each pair's sizes'''
+
+    t = np.empty(runs)
+    p = np.empty(runs)
+    dof = np.empty(runs, dtype = np.int64)
+
+    # Every run draws 2 padded samples of 60 values
+    for start, stop in _chunks(rng, runs, BLOCK_CELLS // 120):
+        size_a, size_b, shift, a, b = _draw(rng, start, stop - start, _t_samples)
+        mean_a, var_a = _masked_stats(a, size_a)
+        mean_b, var_b = _masked_stats(b, size_b)
+        t[start:stop], p[start:stop], dof[start:stop] = t_from_stats(size_a, mean_a, var_a, size_b, mean_b + shift, var_b)
+
+    return t, p, dof
+
+
+def t_mixture_pdf(x, dof):
+    '''Density of T values from tests with varying degrees of freedom, as the
+    T densities of every distinct dof weighted by how often it occurs'''
+    values, counts = np.unique(dof, return_counts = True)
+    weights = counts / counts.sum()
+    return sum(w * scstats.t.pdf(x, d) for d, w in zip(values, weights))
@@ -0,0 +1,181 @@
+import session
+
+import numpy as np
+import pandas as pd
+
+import os
+import tempfile
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Replicates kept in memory before they're written out
+CHUNK_ROWS = 100000
+
+# Columns of an export. The seed and replicate index are enough to draw the
+# replicate again on its own, see parallel.Replicates
+COLUMNS = ('statistic', 'p_value', 'dof', 'seed', 'replicate')
+DTYPE = np.dtype([('statistic', '<f8'), ('p_value', '<f8'), ('dof', '<f8'), ('seed', '<i8'), ('replicate', '<i8')])
+
+# .npy headers are written with room for this many replicates, and filled in on close
+MAX_REPLICATES = 2 ** 63 - 1
+
+
+def formats():
+    '''File dialog types of the formats that can be written here'''
+    types = [("NumPy Files", "*.npy"), ("CSV Files", "*.csv")]
+    if pyarrow is not None:
+        types.append(("Parquet Files", "*.parquet"))
+    return tuple(types)
+
+
+class ReplicateWriter:
+    '''ReplicateWriter class to stream simulated replicates to a .npy, CSV
+    or Parquet file, picked by the extension. Replicates are kept until a
+    chunk is full and then written to a temporary file next to the target,
+    which close() moves into place, so an export that fails or is stopped
+    never leaves half a file behind'''
+
+
+    def __init__(self, file_name, seed, chunk_rows = CHUNK_ROWS):
+        self.file_name = file_name
+        self.kind = os.path.splitext(file_name)[1].lower()
+        if self.kind not in ('.npy', '.csv', '.parquet'):
+            raise ValueError('Replicates can only be exported as .npy, .csv or .parquet')
+        if self.kind == '.parquet' and pyarrow is None:
+            raise ValueError('Parquet export needs pyarrow to be installed')
+
+        # Writer state
+        self.seed = seed
+        self.chunk_rows = chunk_rows
+        self.pending = []
+        self.pending_rows = 0
+        self.count = 0
+
+        directory = os.path.dirname(os.path.abspath(file_name))
+        self.file = tempfile.NamedTemporaryFile('wb', dir = directory, suffix = self.kind, delete = False)
+        if self.kind == '.npy':
+            self.file.write(_npy_header(MAX_REPLICATES))
+        elif self.kind == '.csv':
+            self.file.write((','.join(COLUMNS) + '\n').encode('utf-8'))
+        else:
+            self.schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(DTYPE[name])) for name in COLUMNS])
+            self.parquet = pyarrow.parquet.ParquetWriter(self.file, self.schema)
+
+
+    def write(self, statistic, p, dof, replicate):
+        '''Adds a batch of replicates. dof may be one value for the whole batch
+        or one per replicate, replicate is the index of each one'''
+        statistic = np.asarray(statistic, dtype = np.float64).ravel()
+        records = np.empty(len(statistic), dtype = DTYPE)
+        records['statistic'] = statistic
+        records['p_value'] = p
+        records['dof'] = dof
+        records['seed'] = self.seed
+        records['replicate'] = replicate
+        self.pending.append(records)
+        self.pending_rows += len(records)
+        if self.pending_rows >= self.chunk_rows:
+            self.flush()
+
+
+    def flush(self):
+        if not self.pending:
+            return
+        records = np.concatenate(self.pending)
+        self.pending = []
+        self.pending_rows = 0
+        if self.kind == '.npy':
+            self.file.write(records.tobytes())
+        elif self.kind == '.csv':
+            pd.DataFrame(records).to_csv(self.file, header = False, index = False)
+        else:
+            self.parquet.write_table(pyarrow.Table.from_arrays([np.ascontiguousarray(records[name]) for name in COLUMNS], schema = self.schema))
+        self.count += len(records)
+
+
+    def close(self):
+        '''Writes what's left and moves the finished file into place'''
+        try:
+            self.flush()
+            if self.kind == '.npy':
+                self.file.seek(0)
+                self.file.write(_npy_header(self.count, len(_npy_header(MAX_REPLICATES))))
+            elif self.kind == '.parquet':
+                self.parquet.close()
+            self.file.close()
+        except Exception:
+            self.abort()
+            raise
+        session.replace_file(self.file.name, self.file_name)
+
+
+    def abort(self):
+        '''Stops the export, deleting the temporary file'''
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except OSError:
+            pass
+
+
+class ExportControl:
+    '''ExportControl class for the Export replicates button of a simulation
+    page. Toggling asks for a file and starts streaming replicates to it, or
+    finishes the file being written, showing the outcome on a label'''
+
+
+    def __init__(self):
+        self.writer = None
+
+
+    def toggle(self, seed, button, label):
+
+        # Stream every replicate from now on to a file, or finish the file
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            button.config(text = 'Export replicates')
+            try:
+                writer.close()
+                label.config(text = f'Exported {writer.count} replicates to {os.path.basename(writer.file_name)}')
+            except OSError:
+                label.config(text = 'Error: could not export the replicates')
+            return
+
+        # Only the pages need Tk, so the dialog is imported here
+        from tkinter import filedialog
+        file_name = filedialog.asksaveasfilename(initialdir = os.path.expanduser("~"), defaultextension = '.npy', filetypes = formats())
+        if not file_name:
+            return
+        try:
+            self.writer = ReplicateWriter(file_name, seed)
+        except ValueError as e:
+            label.config(text = f'Error: {e}')
+            return
+        except OSError:
+            label.config(text = 'Error: could not export the replicates')
+            return
+        button.config(text = 'Stop export')
+        label.config(text = f'Exporting replicates to {os.path.basename(file_name)}')
+
+
+    def close(self, event = None):
+        '''Finishes the file being written, for when the page closes'''
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def _npy_header(count, size = None):
+    '''Version 1.0 .npy header of count replicates, padded with spaces to
+    size bytes so a finished header can be written over the first one'''
+    text = repr({'descr': np.lib.format.dtype_to_descr(DTYPE), 'fortran_order': False, 'shape': (count,)})
+    if size is None:
+        size = -(-(len(text) + 11) // 64) * 64
+    text = text.ljust(size - 11) + '\n'
+    return np.lib.format.magic(1, 0) + len(text).to_bytes(2, 'little') + text.encode('latin1')
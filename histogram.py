@@ -0,0 +1,36 @@
+import distcache
+
+import numpy as np
+
+
+class Histogram:
+    '''Histogram with fixed bin edges that counts values as they arrive,
+    with a final overflow bin for values past the last edge'''
+
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype = np.float64)
+        self.counts = np.zeros(len(self.edges), dtype = np.int64)
+        self.total = 0
+
+
+    @classmethod
+    def for_chi2(cls, dof, bins = 50, quantile = distcache.CHI_QUANTILE):
+        '''Equal width bins from 0 to the given quantile of chi2(dof), so the
+        edges stay the same however many replicates are added'''
+        return cls(np.linspace(0, distcache.quantile('chi2', dof, quantile), bins + 1))
+
+
+    @property
+    def width(self):
+        return self.edges[1] - self.edges[0]
+
+
+    def add(self, values):
+
+        # Bin i holds edges[i] <= value < edges[i + 1], anything past the last
+        # edge lands in the overflow bin at the end
+        index = np.searchsorted(self.edges, values, side = 'right') - 1
+        index = np.clip(index, 0, len(self.counts) - 1)
+        self.counts += np.bincount(index, minlength = len(self.counts))
+        self.total += len(values)
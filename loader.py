@@ -0,0 +1,260 @@
+import numpy as np
+import pandas as pd
+
+
+# Rows read from a CSV file at a time
+CHUNK_ROWS = 100000
+
+# Most non-numeric row numbers listed in an error
+MAX_REPORTED = 10
+
+# Most categories either column of a categorical file may have
+MAX_CATEGORIES = 100
+
+
+class RunningStats:
+    '''RunningStats class to keep the count, mean and sum of squared
+    deviations of each column of a file, updated a chunk at a time with
+    the pairwise (Chan et al.) update so it stays stable for long files'''
+
+
+    def __init__(self, columns):
+        self.names = [f'Column {i + 1}' for i in range(columns)]
+        self.n = np.zeros(columns, dtype = np.int64)
+        self.mean = np.zeros(columns)
+        self.m2 = np.zeros(columns)
+
+
+    def add(self, block):
+        '''Adds a (rows, columns) block of values, skipping NaN'''
+
+        # Statistics of the block on its own
+        present = ~np.isnan(block)
+        n_block = present.sum(axis = 0)
+        safe_n = np.maximum(n_block, 1)
+        mean_block = np.where(present, block, 0).sum(axis = 0) / safe_n
+        m2_block = np.where(present, (block - mean_block) ** 2, 0).sum(axis = 0)
+
+        # Merge them into the running statistics
+        n = self.n + n_block
+        safe_total = np.maximum(n, 1)
+        delta = mean_block - self.mean
+        self.mean = self.mean + delta * n_block / safe_total
+        self.m2 = self.m2 + m2_block + delta ** 2 * self.n * n_block / safe_total
+        self.n = n
+
+
+    @property
+    def var(self):
+        '''Sample variance (ddof = 1) of each column'''
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return self.m2 / (self.n - 1)
+
+
+def _numeric(chunk):
+    '''Chunk as floats, with a mask of the cells that held something other
+    than a number'''
+    values = chunk.apply(pd.to_numeric, errors = 'coerce')
+    bad = values.isna() & chunk.notna()
+    return values.to_numpy(dtype = np.float64), bad.to_numpy().any(axis = 1)
+
+
+def _describe_rows(rows, count):
+    listed = ', '.join(str(row) for row in rows)
+    if count > len(rows):
+        listed += f' and {count - len(rows)} more'
+    return listed
+
+
+def _numeric_blocks(source, chunk_rows):
+    '''Yields the numeric (rows, columns) block of each chunk of a CSV file
+    (a name or an open file) with the header names, which are None without a
+    header row and after the first chunk. A first row that isn't numeric is
+    taken as a header. Raises ValueError once the file is read, naming the
+    rows (counting from 1) that hold anything but numbers'''
+
+    bad_rows = []
+    bad_count = 0
+    row = 0
+    try:
+        chunks = pd.read_csv(source, header = None, chunksize = chunk_rows, skip_blank_lines = True)
+    except pd.errors.EmptyDataError:
+        raise ValueError('File is empty')
+    for chunk in chunks:
+        values, bad = _numeric(chunk)
+
+        # Header row
+        header = None
+        if row == 0 and bad[0]:
+            header = [str(name).strip() if pd.notna(name) else f'Column {i + 1}' for i, name in enumerate(chunk.iloc[0])]
+            values = values[1:]
+            bad = bad[1:]
+            row = 1
+
+        bad_count += bad.sum()
+        bad_rows.extend((np.flatnonzero(bad)[:MAX_REPORTED - len(bad_rows)] + row + 1).tolist())
+        yield values[~bad], header
+        row += len(bad)
+
+    if row == 0:
+        raise ValueError('File is empty')
+    if bad_count:
+        raise ValueError(f'Rows {_describe_rows(bad_rows, bad_count)} must have only numbers')
+
+
+def _kept_columns(n, columns):
+    '''Mask of the columns that aren't empty, checking there are as many as expected'''
+    keep = n > 0
+    if columns is not None and keep.sum() != columns:
+        raise ValueError(f'File must have {columns} columns')
+    return keep
+
+
+def iter_column_stats(file_name, columns = None, chunk_rows = CHUNK_ROWS):
+    '''read_column_stats a chunk at a time, for reading on a background
+    worker. Yields (bytes read, None) after every chunk and then (bytes read,
+    stats) once the file is read. Closing the generator stops the read and
+    closes the file'''
+
+    stats = None
+    with open(file_name, 'rb') as f:
+        for values, header in _numeric_blocks(f, chunk_rows):
+            if stats is None:
+                stats = RunningStats(values.shape[1])
+            if header is not None:
+                stats.names = header
+            stats.add(values)
+            yield f.tell(), None
+
+        # Drop empty columns
+        keep = _kept_columns(stats.n, columns)
+        stats.n, stats.mean, stats.m2 = stats.n[keep], stats.mean[keep], stats.m2[keep]
+        stats.names = [name for name, kept in zip(stats.names, keep) if kept]
+        yield f.tell(), stats
+
+
+def read_column_stats(file_name, columns = None, chunk_rows = CHUNK_ROWS):
+    '''Streams a CSV file a chunk at a time, returning the RunningStats of its
+    numeric columns without holding the file in memory. Empty columns are
+    dropped, and columns must give the exact number of columns expected.
+    A header row gives the column names. Raises ValueError naming the rows
+    that hold anything but numbers'''
+
+    for read, stats in iter_column_stats(file_name, columns, chunk_rows):
+        pass
+    return stats
+
+
+def read_columns(file_name, columns = None, chunk_rows = CHUNK_ROWS):
+    '''Every value of each numeric column of a CSV file, for methods such as
+    the bootstrap that need the data itself. Columns may have different
+    lengths, empty cells are left out. Checked the same way as
+    read_column_stats'''
+
+    blocks = []
+    for values, header in _numeric_blocks(file_name, chunk_rows):
+        blocks.append(values)
+    values = np.concatenate(blocks)
+    data = [column[~np.isnan(column)] for column in values.T]
+    keep = _kept_columns(np.array([len(column) for column in data]), columns)
+    return [column for column, kept in zip(data, keep) if kept]
+
+
+class ContingencyCounter:
+    '''ContingencyCounter class to build the contingency table of two
+    categorical columns a chunk at a time. Each chunk's values are factorized
+    and their codes mapped onto codes kept for the whole file, so a chunk is
+    counted with one bincount of the combined codes and memory only grows
+    with the number of categories'''
+
+
+    def __init__(self, max_categories = MAX_CATEGORIES):
+        self.max_categories = max_categories
+        self.codes = ({}, {})
+        self.categories = ([], [])
+        self.counts = np.zeros((0, 0), dtype = np.int64)
+        self.skipped = 0
+
+
+    def _file_codes(self, values, column):
+        '''Codes of a chunk of one column for the whole file, -1 where empty'''
+        chunk_codes, uniques = pd.factorize(values)
+
+        # Only the categories of the chunk are looked up, not every value
+        codes = self.codes[column]
+        for category in uniques:
+            if category not in codes:
+                codes[category] = len(codes)
+                self.categories[column].append(category)
+        if len(codes) > self.max_categories:
+            raise ValueError(f'Column {column + 1} has more than {self.max_categories} categories')
+
+        # Empty values are -1, which picks the -1 added at the end
+        mapping = np.array([codes[category] for category in uniques] + [-1], dtype = np.int64)
+        return mapping[chunk_codes]
+
+
+    def add(self, rows, columns):
+        '''Adds a chunk of the two columns, skipping rows with either value empty'''
+        row_codes = self._file_codes(rows, 0)
+        column_codes = self._file_codes(columns, 1)
+        present = (row_codes >= 0) & (column_codes >= 0)
+        self.skipped += len(present) - int(present.sum())
+
+        # Make room for categories first seen in this chunk
+        shape = (len(self.categories[0]), len(self.categories[1]))
+        if shape != self.counts.shape:
+            counts = np.zeros(shape, dtype = np.int64)
+            counts[:self.counts.shape[0], :self.counts.shape[1]] = self.counts
+            self.counts = counts
+
+        cells = row_codes[present] * shape[1] + column_codes[present]
+        self.counts += np.bincount(cells, minlength = shape[0] * shape[1]).reshape(shape)
+
+
+    def table(self):
+        '''Counts with the row and column categories, each sorted by name.
+        Categories only ever seen next to an empty value have no counted rows,
+        so they're left out rather than giving null rows or columns'''
+        rows = [i for i in np.argsort(self.categories[0], kind = 'stable') if self.counts[i].any()]
+        columns = [j for j in np.argsort(self.categories[1], kind = 'stable') if self.counts[:, j].any()]
+        return (self.counts[np.ix_(rows, columns)],
+                [self.categories[0][i] for i in rows],
+                [self.categories[1][j] for j in columns])
+
+
+def iter_contingency(file_name, chunk_rows = CHUNK_ROWS, max_categories = MAX_CATEGORIES):
+    '''read_contingency a chunk at a time, for reading on a background
+    worker. Yields (bytes read, None) after every chunk and then (bytes read,
+    counter) once the file is read. Closing the generator stops the read and
+    closes the file'''
+
+    counter = ContingencyCounter(max_categories)
+    with open(file_name, 'rb') as f:
+
+        # Only the first two columns are parsed, as text
+        try:
+            chunks = pd.read_csv(f, usecols = [0, 1], dtype = str, chunksize = chunk_rows, skipinitialspace = True)
+        except pd.errors.EmptyDataError:
+            raise ValueError('File is empty')
+        except ValueError:
+            raise ValueError('File must have at least 2 columns')
+        for chunk in chunks:
+            counter.add(chunk.iloc[:, 0], chunk.iloc[:, 1])
+            yield f.tell(), None
+
+        if min(counter.table()[0].shape) < 2:
+            raise ValueError('Both columns must have at least 2 categories')
+        yield f.tell(), counter
+
+
+def read_contingency(file_name, chunk_rows = CHUNK_ROWS, max_categories = MAX_CATEGORIES):
+    '''Streams a long format CSV file a chunk at a time, returning the
+    ContingencyCounter of its first two columns, with a row per individual
+    and a header row. Rows with either value empty are skipped. Raises
+    ValueError if a column has fewer than 2 or more than max_categories
+    categories'''
+
+    for read, counter in iter_contingency(file_name, chunk_rows, max_categories):
+        pass
+    return counter
@@ -1,8 +1,35 @@
 from MainPage import MainPage
+
 import tkinter as tk
+import argparse
+import sys
+
+
+def main(argv = None):
+
+    # Without arguments the UI is started straight away, without importing
+    # the simulation commands and the libraries they need
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        start_ui()
+        return
+
+    import batch
+    parser = argparse.ArgumentParser(description = 'Statistics visualisation')
+    subparsers = parser.add_subparsers(dest = 'command')
+    batch.add_commands(subparsers)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        start_ui()
+    else:
+        try:
+            args.func(args)
+        except ValueError as e:
+            parser.exit(1, f'Error! {e}\n')
 
 
-def main():
+def start_ui():
     root = tk.Tk()
     MainPage(root)
     root.mainloop()
@@ -0,0 +1,199 @@
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+import os
+import secrets
+
+
+# Replicates per batch handed to a process
+BATCH_SIZE = 10000
+
+# Replicates drawn from each block of the counter-based generator. Samplers
+# may draw blocks of any multiple of this
+REPLICATE_BLOCK = 256
+
+# Shared process pool, created on first use and kept between runs
+_pool = None
+_pool_workers = None
+
+
+class SeededStream:
+    '''SeededStream class to hand out independent generators spawned from
+    one master seed. Every batch gets its own child generator in the order
+    the batches are made, so results only depend on the seed and the batch
+    sizes, never on which process ran a batch. Simulated replicates are
+    numbered instead, and taken as Replicates ranges of the seed, keeping
+    which sampler drew each range so any replicate can be drawn again'''
+
+
+    def __init__(self, seed = None, spawned = 0, replicates = 0, samplers = None):
+
+        # Restoring the number of children spawned and replicates taken carries on a saved stream
+        self.seed = secrets.randbelow(2 ** 32) if seed is None else seed
+        self.seed_sequence = np.random.SeedSequence(self.seed, n_children_spawned = spawned)
+        self.replicates = replicates
+
+        # [first replicate, sampler name, block] wherever the sampler changes
+        self.samplers = [] if samplers is None else [list(sampler) for sampler in samplers]
+
+
+    @property
+    def spawned(self):
+        return self.seed_sequence.n_children_spawned
+
+
+    def spawn(self, n):
+        return self.seed_sequence.spawn(n)
+
+
+    def generator(self):
+        '''A single new generator, for one-off draws on the UI thread'''
+        return np.random.default_rng(self.spawn(1)[0])
+
+
+    def take(self, runs, sampler, block = REPLICATE_BLOCK):
+        '''The next runs replicates, drawn by the named sampler in blocks of
+        block replicates'''
+        if not self.samplers or self.samplers[-1][1:] != [sampler, block]:
+            self.samplers.append([self.replicates, sampler, block])
+        replicates = Replicates(self.seed, self.replicates, block)
+        self.replicates += runs
+        return replicates
+
+
+    def sampler_of(self, replicate):
+        '''(sampler name, block) of a replicate, or None if it hasn't been drawn'''
+        if replicate < 0 or replicate >= self.replicates or not self.samplers or replicate < self.samplers[0][0]:
+            return None
+        index = bisect.bisect_right([sampler[0] for sampler in self.samplers], replicate) - 1
+        return tuple(self.samplers[index][1:])
+
+
+    def rewind(self, replicates):
+        '''Gives back every replicate from number replicates on, as if they
+        had never been taken'''
+        self.replicates = min(self.replicates, replicates)
+        while self.samplers and self.samplers[-1][0] >= self.replicates:
+            self.samplers.pop()
+
+
+class Replicates:
+    '''Replicates class for the replicates of a seed from number first on.
+    Replicate i is row i % block of what is drawn for its block of a Philox
+    generator keyed by the seed, which starts at its own counter. So a
+    replicate is the same whichever run made it, and any one can be made
+    again from its block alone'''
+
+
+    def __init__(self, seed, first, block = REPLICATE_BLOCK):
+        if block % REPLICATE_BLOCK:
+            raise ValueError(f'Blocks must be a multiple of {REPLICATE_BLOCK} replicates')
+        self.seed = seed
+        self.first = first
+        self.block = block
+
+
+    def chunks(self, runs, size):
+        '''(start, stop) of chunks of runs replicates from first on, of about
+        size replicates and ending on block boundaries so no block is drawn
+        for two chunks'''
+        step = max(1, size // self.block) * self.block
+        bounds = [0, *range(step - self.first % step, runs, step), runs]
+        return [(start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+
+
+    def draw(self, start, runs, sample):
+        '''sample(n, rng) for replicates first + start to first + start + runs,
+        where sample draws n replicates (an array, or a tuple of arrays, of n
+        rows) from a generator'''
+        first = self.first + start
+        parts = []
+        for block in range(first // self.block, (first + runs - 1) // self.block + 1):
+            offset = block * self.block
+            rows = sample(self.block, block_generator(self.seed, offset // REPLICATE_BLOCK))
+            rows_kept = slice(max(first - offset, 0), min(first + runs - offset, self.block))
+            parts.append(tuple(part[rows_kept] for part in rows) if isinstance(rows, tuple) else rows[rows_kept])
+        if isinstance(parts[0], tuple):
+            return tuple(np.concatenate(part) for part in zip(*parts))
+        return np.concatenate(parts)
+
+
+def block_generator(seed, counter):
+    '''Generator of a block of replicates, from its own stretch of counter
+    values of a Philox generator keyed by the seed. Counters are numbered in
+    REPLICATE_BLOCK replicates, and each has 2 ** 64 values to itself'''
+    return np.random.Generator(np.random.Philox(key = seed, counter = [0, counter, 0, 0]))
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def get_pool(workers):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures = True)
+        _pool = ProcessPoolExecutor(max_workers = workers)
+        _pool_workers = workers
+    return _pool
+
+
+def batch_sizes(runs, batch_size = BATCH_SIZE):
+    return [min(batch_size, runs - start) for start in range(0, runs, batch_size)]
+
+
+def _run_job(job, args, runs, seed):
+    return job(*args, runs, seed if isinstance(seed, Replicates) else np.random.default_rng(seed))
+
+
+def run_batches(job, args, runs, stream, workers = 1, batch_size = BATCH_SIZE, sampler = None, block = REPLICATE_BLOCK):
+    '''Yields (runs, result) for each batch of job(*args, runs, rng) in order.
+    Given a sampler name, rng is the next Replicates range of the stream
+    drawn in blocks of block replicates, and batches end on block boundaries.
+    Otherwise it's a spawned generator. With more than one worker the
+    batches run on the shared process pool, and closing the generator
+    cancels the batches that haven't started'''
+
+    if sampler is None:
+        sizes = batch_sizes(runs, batch_size)
+        seeds = stream.spawn(len(sizes))
+    else:
+        first = stream.replicates
+        chunks = Replicates(stream.seed, first, block).chunks(runs, batch_size)
+        sizes = [stop - start for start, stop in chunks]
+        seeds = [stream.take(size, sampler, block) for size in sizes]
+
+    # When the run is cancelled or fails, the replicates of batches that were
+    # never yielded are given back, so the stream only counts those drawn
+    delivered = 0
+    futures = []
+    try:
+
+        # Small runs aren't worth the cost of sending them to other processes
+        if workers <= 1 or len(sizes) == 1:
+            for size, seed in zip(sizes, seeds):
+                result = _run_job(job, args, size, seed)
+                delivered += size
+                yield size, result
+            return
+
+        pool = get_pool(workers)
+        futures = [pool.submit(_run_job, job, args, size, seed) for size, seed in zip(sizes, seeds)]
+        for size, future in zip(sizes, futures):
+            result = future.result()
+            delivered += size
+            yield size, result
+    finally:
+        for future in futures:
+            future.cancel()
+        if sampler is not None:
+            stream.rewind(first + delivered)
+
+
+def merge_results(results):
+    '''Joins batch results in order, keeping values shared by every batch
+    (such as the degrees of freedom of a table) as they are'''
+    results = list(results)
+    return tuple(np.concatenate(parts) if isinstance(parts[0], np.ndarray) else parts[0] for parts in zip(*results))
@@ -0,0 +1,178 @@
+import collections
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# Most events kept, the oldest are dropped first
+MAX_EVENTS = 100000
+
+# Seconds of replicates counted for the replicates per second rate
+RATE_WINDOW = 2.0
+
+# Setting STATVIS_PROFILE=1 records from the start
+ENV_VARIABLE = 'STATVIS_PROFILE'
+
+_NOTHING = contextlib.nullcontext()
+
+
+def rss():
+    '''Resident memory of this process in bytes, or None where it can't be read.
+    psutil is used if it's installed, then /proc, then the peak from resource'''
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # Peak rather than current, in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Profiler:
+    '''Profiler class to time named phases of the pages and record memory
+    and replicate counts on one timeline. While disabled every call returns
+    at once without recording, so the hooks can stay in the code'''
+
+
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.events = collections.deque(maxlen = MAX_EVENTS)
+        self.replicates = collections.deque()
+        self.frames = collections.deque(maxlen = 30)
+        self.lock = threading.Lock()
+
+
+    def phase(self, name, **args):
+        '''Context manager timing a phase, such as with profiler.phase('draw')'''
+        if not self.enabled:
+            return _NOTHING
+        return self._phase(name, args)
+
+
+    @contextlib.contextmanager
+    def _phase(self, name, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start, args)
+
+
+    def add(self, name, start, seconds, args = None):
+        self.events.append(('X', name, start - self.start, seconds, threading.get_ident(), args or {}))
+
+
+    def add_frame(self, name, start, seconds):
+        '''Records a redraw of a page, with the memory in use after it'''
+        self.add(name, start, seconds)
+        self.frames.append(seconds)
+        memory = rss()
+        if memory is not None:
+            self.events.append(('C', 'rss', time.perf_counter() - self.start, 0, 0, {'MiB': memory / 2 ** 20}))
+
+
+    def count(self, replicates):
+        '''Adds replicates to the replicates per second rate'''
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            self.replicates.append((now, replicates))
+            while self.replicates and self.replicates[0][0] < now - RATE_WINDOW:
+                self.replicates.popleft()
+
+
+    def rate(self):
+        '''Replicates per second over the last RATE_WINDOW seconds'''
+        now = time.perf_counter()
+        with self.lock:
+            recent = [count for stamp, count in self.replicates if stamp >= now - RATE_WINDOW]
+        return sum(recent) / RATE_WINDOW
+
+
+    def frame_ms(self):
+        '''Last and mean time of the recent frames in ms, None before any frame'''
+        if not self.frames:
+            return None, None
+        return self.frames[-1] * 1000, sum(self.frames) / len(self.frames) * 1000
+
+
+    def summary(self):
+        '''Count, total, mean and max ms of each phase'''
+        phases = {}
+        for kind, name, start, seconds, thread, args in list(self.events):
+            if kind != 'X':
+                continue
+            phase = phases.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            phase['count'] += 1
+            phase['total_ms'] += seconds * 1000
+            phase['max_ms'] = max(phase['max_ms'], seconds * 1000)
+        for phase in phases.values():
+            phase['mean_ms'] = phase['total_ms'] / phase['count']
+        return phases
+
+
+    def clear(self):
+        self.events.clear()
+        self.frames.clear()
+        with self.lock:
+            self.replicates.clear()
+
+
+    def chrome_trace(self):
+        '''Events in the Chrome trace format, for chrome://tracing or Perfetto'''
+        pid = os.getpid()
+        trace = []
+        for kind, name, start, seconds, thread, args in list(self.events):
+            event = {'name': name, 'ph': kind, 'ts': start * 1e6, 'pid': pid, 'tid': thread, 'args': args}
+            if kind == 'X':
+                event['dur'] = seconds * 1e6
+            trace.append(event)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+    def export(self, file_name):
+        '''Writes the Chrome trace and a summary of every phase as JSON'''
+        with open(file_name, 'w') as f:
+            json.dump({**self.chrome_trace(), 'summary': self.summary()}, f)
+
+
+profiler = Profiler(enabled = os.environ.get(ENV_VARIABLE) == '1')
+
+
+def timed(name, frame = False):
+    '''Decorator timing every call of a function as a phase, and as a frame
+    of the overlay's frame times if frame is set'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if frame:
+                    profiler.add_frame(name, start, time.perf_counter() - start)
+                else:
+                    profiler.add(name, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
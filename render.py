@@ -0,0 +1,212 @@
+from histogram import Histogram
+import distcache
+import engine
+import loader
+import parallel
+import session
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Polygon
+
+import numpy as np
+from scipy import stats as scstats
+
+import os
+
+
+# Figure look, matching the pages
+BG_COLOR = '#f0f0f0'
+FG_COLOR = '#1c1c1c'
+FIGURE_SIZE = (10, 5)
+DPI = 100
+
+FORMATS = ('png', 'svg', 'pdf')
+TABLE_EXTENSIONS = ('.session', '.stat')
+
+# Chi square tests simulated for each histogram, and the critical value marked
+CHI_RUNS = 10000
+CRITICAL_LEVEL = 0.95
+
+# Templates made in this process, reused for every figure of their kind
+_templates = {}
+
+
+class ChiTemplate:
+    '''ChiTemplate class for the chi square page's histogram with the chi
+    square density over it. The figure and its bars and lines are made once,
+    and each figure only moves them'''
+
+
+    def __init__(self):
+        self.fig = Figure(figsize = FIGURE_SIZE, dpi = DPI, facecolor = BG_COLOR)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.ax.set_facecolor(BG_COLOR)
+        self.ax.get_yaxis().set_visible(False)
+
+        # Same bins as the page, with the overflow bin in grey
+        self.bars = self.ax.bar(np.arange(len(Histogram.for_chi2(1).counts)), 0, width = 1, align = 'edge')
+        self.bars[-1].set_color('grey')
+        self.line, = self.ax.plot([], [], color = 'r', lw = 2)
+        self.critical_line = self.ax.axvline(0, color = 'orange', lw = 2, label = f'Simulated {round(CRITICAL_LEVEL * 100)}% critical value')
+        self.critical_theory = self.ax.axvline(0, color = 'r', ls = '--', label = f'Chi square {round(CRITICAL_LEVEL * 100)}% critical value')
+        self.ax.legend(loc = 'upper right')
+
+
+    def draw(self, title, histogram, dof, critical):
+        width = histogram.width
+        for bar, left, count in zip(self.bars, histogram.edges, histogram.counts):
+            bar.set_x(left)
+            bar.set_width(width)
+            bar.set_height(count)
+
+        # Expected counts per bin if the null hypothesis holds
+        x, pdf = distcache.curve('chi2', dof, distcache.CHI_START, histogram.edges[-1])
+        self.line.set_data(x, histogram.total * width * pdf)
+        self.critical_line.set_xdata([critical, critical])
+        theory = distcache.quantile('chi2', dof, CRITICAL_LEVEL)
+        self.critical_theory.set_xdata([theory, theory])
+
+        self.ax.set_xlim(0, histogram.edges[-1] + width)
+        self.ax.set_ylim(0, max(histogram.counts.max(), 1) * 1.1)
+        self.ax.set_title(title)
+
+
+class TTemplate:
+    '''TTemplate class for the T test page's two graphs, the normal curves
+    of the data and the T distribution with its tails and the T value'''
+
+
+    def __init__(self):
+        self.fig = Figure(figsize = FIGURE_SIZE, dpi = DPI, facecolor = BG_COLOR)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots(1, 2)
+        self.fig.subplots_adjust(top = 0.8)
+        for ax in self.ax:
+            ax.set_facecolor(BG_COLOR)
+        self.ax[0].set_title('Data sets (normal distributions)')
+        self.ax[1].set_title('T Distribution')
+
+        self.data_lines = [self.ax[0].plot([], [])[0] for _ in range(2)]
+        self.t_curve, = self.ax[1].plot([], [], color = FG_COLOR)
+        self.tails = [self.ax[1].add_patch(Polygon(np.zeros((1, 2)), color = FG_COLOR)) for _ in range(2)]
+        self.t_line, = self.ax[1].plot([], [], color = 'orange')
+
+
+    def draw(self, title, n, mean, var):
+        t, p, dof, extents = move_t_graphs(self.data_lines, self.t_curve, self.tails, self.t_line, n, mean, var)
+        (left, right, top), (t_left, t_right, t_top) = extents
+        self.ax[0].set_xlim(left - 0.05 * (right - left), right + 0.05 * (right - left))
+        self.ax[0].set_ylim(0, top * 1.05)
+        self.ax[1].set_xlim(min(t_left, t) - 0.2, max(t_right, t) + 0.2)
+        self.ax[1].set_ylim(0, t_top * 1.05)
+
+        self.fig.suptitle(f"{title}\nT value: {round(t, 2)}, P value: {round(p, 2)}, {'Significant' if p < 0.05 else 'Insignificant'}")
+
+
+def move_t_graphs(data_lines, t_curve, tails, t_line, n, mean, var):
+    '''Moves the T test graphs' artists to the statistics of two samples, for
+    the page and the rendered figures alike. Returns the T and P values, the
+    degrees of freedom and the (left, right, top) extent of each graph'''
+    t, p, dof = engine.t_from_stats(n[0], mean[0], var[0], n[1], mean[1], var[1])
+
+    # Left graph, the normal curve of each sample
+    sigma = np.sqrt(var)
+    for line, mu, sd in zip(data_lines, mean, sigma):
+        x = np.linspace(mu - 3 * sd, mu + 3 * sd, 100)
+        line.set_data(x, scstats.norm.pdf(x, mu, sd))
+    data_extent = ((mean - 3 * sigma).min(), (mean + 3 * sigma).max(), scstats.norm.pdf(0, 0, sigma.min()))
+
+    # Right graph, with the tail regions below it
+    x, y = distcache.quantile_curve('t', dof, 0.001, 0.999)
+    t_curve.set_data(x, y)
+    for tail, (lower, upper) in zip(tails, ((0.975, 0.999), (0.001, 0.025))):
+        tail_x, tail_y = distcache.quantile_curve('t', dof, lower, upper)
+        tail.set_xy(np.column_stack((np.r_[tail_x[0], tail_x, tail_x[-1]], np.r_[0, tail_y, 0])))
+
+    # The T value, hidden when it's far off the curve
+    t_line.set_data([t, t], [0, scstats.t.pdf(t, dof)])
+    t_line.set_visible(p >= 0.005 and p <= 0.995)
+    return t, p, dof, (data_extent, (x[0], x[-1], y.max()))
+
+
+def _template(kind):
+    if kind not in _templates:
+        _templates[kind] = ChiTemplate() if kind == 'chi' else TTemplate()
+    return _templates[kind]
+
+
+def render_chi(file_name, out_name, runs, replicates):
+    '''Simulates the table of a session or .stat file and saves its histogram'''
+    data_values, sample_size = session.load_table(file_name)
+    chi2, p, dof, valid = engine.chi_batch(engine.table_counts(data_values), sample_size, runs, replicates)
+    chi2 = chi2[valid]
+    histogram = Histogram.for_chi2(dof)
+    histogram.add(chi2)
+
+    template = _template('chi')
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    template.draw(f'{name} - {len(chi2)} runs, {dof} degrees of freedom', histogram, dof, np.quantile(chi2, CRITICAL_LEVEL))
+    template.fig.savefig(out_name)
+
+
+def render_t(file_name, out_name):
+    '''Tests the 2 columns of a CSV file and saves the T test graphs'''
+    stats = loader.read_column_stats(file_name, columns = 2)
+    template = _template('t')
+    template.draw(os.path.splitext(os.path.basename(file_name))[0], stats.n, stats.mean, stats.var)
+    template.fig.savefig(out_name)
+
+
+def render_job(job):
+    '''Renders one figure, returning (input, output, error), where the error
+    is None unless the input couldn't be rendered'''
+    kind, file_name, out_name, args = job
+    try:
+        if kind == 'chi':
+            render_chi(file_name, out_name, *args)
+        else:
+            render_t(file_name, out_name)
+    except Exception as e:
+        return file_name, out_name, str(e) or type(e).__name__
+    return file_name, out_name, None
+
+
+def make_jobs(directory, out_directory, fmt = 'png', runs = CHI_RUNS, stream = None, seeds = 1):
+    '''Jobs for every table and CSV file in a directory. Tables get seeds
+    figures, each simulated from its own replicates of the stream. Figures
+    are named after the whole file name, so x.session and x.csv don't clash'''
+    if fmt not in FORMATS:
+        raise ValueError(f'Figures can only be saved as {", ".join(FORMATS)}')
+    if not os.path.isdir(directory):
+        raise ValueError(f'{directory} is not a directory')
+    stream = parallel.SeededStream() if stream is None else stream
+
+    jobs = []
+    for entry in sorted(os.listdir(directory)):
+        file_name = os.path.join(directory, entry)
+        extension = os.path.splitext(entry)[1]
+        if extension in TABLE_EXTENSIONS:
+            for copy in range(seeds):
+                suffix = f'_{copy + 1}' if seeds > 1 else ''
+                jobs.append(('chi', file_name, os.path.join(out_directory, f'{entry}{suffix}.{fmt}'), (runs, stream.take(runs, engine.CHI_SAMPLER))))
+        elif extension == '.csv':
+            jobs.append(('t', file_name, os.path.join(out_directory, f'{entry}.{fmt}'), ()))
+    if not jobs:
+        raise ValueError(f'No .session, .stat or .csv files in {directory}')
+    return jobs
+
+
+def render_directory(directory, out_directory, fmt = 'png', runs = CHI_RUNS, stream = None, seeds = 1, workers = 1):
+    '''Yields (input, output, error) for the figure of every job from
+    make_jobs, rendered on the shared process pool with more than one worker'''
+    jobs = make_jobs(directory, out_directory, fmt, runs, stream, seeds)
+    os.makedirs(out_directory, exist_ok = True)
+    if workers <= 1 or len(jobs) == 1:
+        yield from map(render_job, jobs)
+        return
+
+    # A few chunks per process keeps the processes busy without sending every job on its own
+    pool = parallel.get_pool(workers)
+    yield from pool.map(render_job, jobs, chunksize = max(1, len(jobs) // (workers * 4)))
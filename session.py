@@ -0,0 +1,218 @@
+import engine
+
+import numpy as np
+
+import json
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+
+
+# File layout: magic, version and header size, a JSON header padded to the
+# header size, then every simulated chi square value as little endian float64
+MAGIC = b'STATVIS\0'
+VERSION = 1
+PREFIX = struct.Struct('<8sII')
+HEADER_BLOCK = 4096
+EXTENSION = '.session'
+
+# Bytes copied at a time when a session is rewritten
+COPY_CHUNK = 2 ** 20
+
+# Longest JSON of a float and its separator, and the most sketch levels, for
+# the room a sketch can grow to
+FLOAT_BYTES = 26
+MAX_SKETCH_LEVELS = 64
+
+# Mode new files get, read once as os.umask can only be read by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+class Session:
+    '''Session class for a saved chi square session. Opening one only reads
+    the header (table, sample size, generator state and histogram), and the
+    replicates are memory mapped when asked for, so big sessions open at
+    once. New replicates are appended to the end of the file'''
+
+
+    def __init__(self, file_name, header, header_size, replicates):
+        self.file_name = file_name
+        self.header = header
+        self.header_size = header_size
+        self.count = replicates
+
+
+    @classmethod
+    def create(cls, file_name, header):
+        '''Writes a new session with no replicates, replacing the file at once
+        so a failed save never leaves half a session behind'''
+        header_size = _header_size(header)
+        directory = os.path.dirname(os.path.abspath(file_name))
+        with tempfile.NamedTemporaryFile('wb', dir = directory, suffix = EXTENSION, delete = False) as f:
+            f.write(_pack_header(header, header_size))
+        replace_file(f.name, file_name)
+        return cls(file_name, header, header_size, 0)
+
+
+    @classmethod
+    def open(cls, file_name):
+        with open(file_name, 'rb') as f:
+            magic, version, header_size = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError('Not a session file')
+            if version > VERSION:
+                raise ValueError('Session was saved by a newer version')
+            header = json.loads(f.read(header_size - PREFIX.size).decode('utf-8'))
+        data_bytes = os.path.getsize(file_name) - header_size
+        return cls(file_name, header, header_size, data_bytes // 8)
+
+
+    @property
+    def replicates(self):
+        '''Memory mapped array of every saved replicate'''
+        if self.count == 0:
+            return np.empty(0)
+        return np.memmap(self.file_name, dtype = '<f8', mode = 'r', offset = self.header_size, shape = (self.count,))
+
+
+    def append(self, values):
+        with open(self.file_name, 'ab') as f:
+            f.write(np.asarray(values, dtype = '<f8').tobytes())
+        self.count += len(values)
+
+
+    def update(self, header):
+        '''Rewrites the header in place, or the whole file when the header has
+        outgrown the space saved for it'''
+        self.header = header
+        if _header_size(header) <= self.header_size:
+            with open(self.file_name, 'r+b') as f:
+                f.write(_pack_header(header, self.header_size))
+            return
+
+        header_size = _header_size(header)
+        directory = os.path.dirname(os.path.abspath(self.file_name))
+        with tempfile.NamedTemporaryFile('wb', dir = directory, suffix = EXTENSION, delete = False) as f:
+            f.write(_pack_header(header, header_size))
+
+            # Copy the replicates a chunk at a time rather than reading them all in
+            with open(self.file_name, 'rb') as old:
+                old.seek(self.header_size)
+                shutil.copyfileobj(old, f, COPY_CHUNK)
+        replace_file(f.name, self.file_name)
+        self.header_size = header_size
+
+
+def replace_file(temp_name, file_name):
+    '''Moves a finished temporary file into place. Temporary files are only
+    readable by their owner, so it first gets the mode of the file it
+    replaces, or the mode of any new file'''
+    try:
+        mode = os.stat(file_name).st_mode & 0o777
+    except FileNotFoundError:
+        mode = NEW_FILE_MODE
+    os.chmod(temp_name, mode)
+    os.replace(temp_name, file_name)
+
+
+def _header_size(header):
+
+    # Leave room for the generator state and every histogram count to grow,
+    # and for the sketch to reach its largest size (about 3 * K items), so
+    # the header is almost always rewritten in place
+    needed = PREFIX.size + len(json.dumps(header).encode('utf-8')) + 1024
+    if header.get('histogram') is not None:
+        needed += 20 * len(header['histogram']['counts'])
+    sketch = header.get('sketch')
+    if sketch is not None:
+        items = 3 * sketch['k'] + 2 * MAX_SKETCH_LEVELS
+        needed += max(0, items * FLOAT_BYTES - len(json.dumps(sketch['levels'])))
+    return -(-needed // HEADER_BLOCK) * HEADER_BLOCK
+
+
+def _pack_header(header, header_size):
+    body = json.dumps(header).encode('utf-8')
+    return PREFIX.pack(MAGIC, VERSION, header_size) + body.ljust(header_size - PREFIX.size)
+
+
+def make_header(data_values, sample_size, seed = None, spawned = 0, replicates = 0, samplers = None, histogram = None, sketch = None, total_runs = 0, fixed_margins = False, exceeding = 0):
+    '''Header of a session, from the labelled table and simulation state'''
+    header = {'rows': [str(title) for title in data_values[1:-1, 0]],
+              'columns': [str(title) for title in data_values[0, 1:-1]],
+              'counts': engine.table_counts(data_values).tolist(),
+              'sample_size': int(sample_size),
+              'seed': seed,
+              'spawned': int(spawned),
+              'replicates': int(replicates),
+              'samplers': [] if samplers is None else [[int(first), name, int(block)] for first, name, block in samplers],
+              'total_runs': int(total_runs),
+              'fixed_margins': bool(fixed_margins),
+              'exceeding': int(exceeding or 0),
+              'histogram': None,
+              'sketch': None}
+    if histogram is not None:
+        header['histogram'] = {'edges': histogram.edges.tolist(), 'counts': histogram.counts.tolist()}
+    if sketch is not None:
+        header['sketch'] = sketch.to_dict()
+    return header
+
+
+def table_from_header(header):
+    '''Labelled table of a session, laid out as the chi square page uses it'''
+    return engine.make_table(header['counts'], header['rows'], header['columns'])
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    '''Unpickler that only rebuilds the NumPy arrays old .stat files hold,
+    so loading one can't run anything else'''
+
+    ALLOWED = {('numpy.core.multiarray', '_reconstruct'), ('numpy._core.multiarray', '_reconstruct'),
+               ('numpy.core.multiarray', 'scalar'), ('numpy._core.multiarray', 'scalar'),
+               ('numpy', 'ndarray'), ('numpy', 'dtype')}
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f'{module}.{name} is not allowed in a .stat file')
+        return super().find_class(module, name)
+
+
+def read_legacy(file_name):
+    '''Labelled table and sample size from an old pickled .stat file'''
+    with open(file_name, 'rb') as f:
+        data_values, sample_size = _LegacyUnpickler(f).load()
+    return data_values, int(sample_size)
+
+
+def migrate(file_name):
+    '''Reads an old .stat file and saves it as a session next to it the
+    first time. Later the session made then is opened instead, with the
+    replicates added to it since, and an existing file is never written over'''
+    data_values, sample_size = read_legacy(file_name)
+    header = make_header(data_values, sample_size)
+    base = os.path.splitext(file_name)[0]
+    session_name = base + EXTENSION
+    copy = 1
+    while os.path.exists(session_name):
+
+        # A session of the same table is the one migrated before
+        try:
+            existing = Session.open(session_name)
+            if all(existing.header.get(key) == header[key] for key in ('rows', 'columns', 'counts', 'sample_size')):
+                return existing
+        except (OSError, ValueError, struct.error):
+            pass
+        copy += 1
+        session_name = f'{base}_{copy}{EXTENSION}'
+    return Session.create(session_name, header)
+
+
+def load_table(file_name):
+    '''Labelled table and sample size of a session or old .stat file'''
+    if file_name.endswith('.stat'):
+        return read_legacy(file_name)
+    header = Session.open(file_name).header
+    return table_from_header(header), header['sample_size']
@@ -0,0 +1,141 @@
+import distcache
+
+import numpy as np
+
+import random
+
+
+# Items kept by the top compactor; the rank error is around 1.7 / K
+K = 1000
+
+# Each compactor below the top keeps this fraction of the one above it
+SHRINK = 2 / 3
+
+
+class QuantileSketch:
+    '''QuantileSketch class for a KLL sketch of a stream of values. Values
+    are kept in compactors where an item at level h stands for 2 ** h values,
+    and a full compactor sorts itself and passes every other item up a level,
+    so memory stays around 3 * K items however many values are added.
+    Sketches of separate runs can be merged'''
+
+
+    def __init__(self, k = K, seed = 0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.random = random.Random(seed)
+
+
+    def add(self, values):
+        values = np.asarray(values, dtype = np.float64).ravel()
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self._compress()
+
+
+    def merge(self, other):
+        '''Adds every value summarised by another sketch'''
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate((self.levels[h], items))
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+
+    def _capacity(self, h):
+        return max(2, int(np.ceil(self.k * SHRINK ** (len(self.levels) - 1 - h))))
+
+
+    def _compress(self):
+
+        # Only compact while the sketch is over its total capacity, each time
+        # the lowest level that is over its own, so levels fill up lazily
+        while self.size > sum(self._capacity(h) for h in range(len(self.levels))):
+            h = next(h for h in range(len(self.levels)) if len(self.levels[h]) > self._capacity(h))
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[h])
+
+            # An odd item out stays behind, and a random offset picks which
+            # half goes up so the ranks stay unbiased
+            odd = len(items) % 2
+            self.levels[h] = items[:odd]
+            promoted = items[odd:][self.random.randrange(2)::2]
+            self.levels[h + 1] = np.concatenate((self.levels[h + 1], promoted))
+
+
+    def _weighted(self):
+        '''Sorted items with their cumulative weights'''
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h, dtype = np.int64) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind = 'stable')
+        return items[order], np.cumsum(weights[order])
+
+
+    def __len__(self):
+        return self.n
+
+
+    @property
+    def size(self):
+        '''Number of items kept'''
+        return sum(len(level) for level in self.levels)
+
+
+    def quantile(self, q):
+        '''Approximate quantiles for q between 0 and 1, NaN while empty'''
+        q = np.asarray(q, dtype = np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        items, cumulative = self._weighted()
+        index = np.searchsorted(cumulative, q * cumulative[-1], side = 'left')
+        values = items[np.clip(index, 0, len(items) - 1)]
+
+        # The smallest and largest values are known exactly
+        return np.where(q <= 0, self.min, np.where(q >= 1, self.max, values))
+
+
+    def cdf(self, x):
+        '''Approximate fraction of the values at most x'''
+        if self.n == 0:
+            return np.full(np.shape(x), np.nan)
+        items, cumulative = self._weighted()
+        index = np.searchsorted(items, x, side = 'right')
+        return np.where(index > 0, cumulative[np.maximum(index - 1, 0)], 0) / cumulative[-1]
+
+
+    def ks_distance(self, dof):
+        '''Kolmogorov-Smirnov distance between the values and chi2(dof), the
+        largest gap between the empirical and the theoretical CDF'''
+        if self.n == 0:
+            return np.nan
+        items, cumulative = self._weighted()
+        total = cumulative[-1]
+        weights = np.diff(cumulative, prepend = 0)
+        expected = distcache.DISTRIBUTIONS['chi2'].cdf(items, dof)
+        return max((cumulative / total - expected).max(), (expected - (cumulative - weights) / total).max())
+
+
+    def to_dict(self):
+        return {'k': self.k, 'n': self.n, 'min': float(self.min), 'max': float(self.max),
+                'levels': [level.tolist() for level in self.levels]}
+
+
+    @classmethod
+    def from_dict(cls, saved):
+        sketch = cls(saved['k'])
+        sketch.n = saved['n']
+        sketch.min = saved['min']
+        sketch.max = saved['max']
+        sketch.levels = [np.array(level, dtype = np.float64) for level in saved['levels']]
+        return sketch
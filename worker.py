@@ -0,0 +1,105 @@
+import os
+import queue
+import threading
+
+
+class BatchWorker:
+    '''BatchWorker class to run a simulation in batches on a background thread.
+    Finished batches are passed back through a queue, so the Tk thread can
+    collect them with poll() from an after() callback'''
+
+
+    def __init__(self, batches):
+
+        # Iterator of (runs, result) pairs, such as parallel.run_batches
+        self.batches = batches
+
+        # Thread state
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.finished = False
+        self.error = None
+        self.thread = threading.Thread(target = self._work, daemon = True)
+
+
+    def start(self):
+        self.thread.start()
+        return self
+
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+    def poll(self):
+        '''Returns the (runs, result) pairs finished since the last poll, and
+        marks the worker finished once the thread has put its last batch'''
+        batches = []
+        while True:
+            try:
+                item = self.results.get_nowait()
+            except queue.Empty:
+                return batches
+            if item is None:
+                self.finished = True
+                return batches
+            batches.append(item)
+
+
+    def _work(self):
+        try:
+            for item in self.batches:
+                self.results.put(item)
+                if self.cancelled.is_set():
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            if hasattr(self.batches, 'close'):
+                self.batches.close()
+            self.results.put(None)
+
+
+class ImportWorker(BatchWorker):
+    '''ImportWorker class to read a file on a background thread, from a
+    generator of (bytes read, result) pairs where the result is None until
+    the file is read, as the loader's iter_ functions give. watch() polls it
+    from the Tk thread, showing the progress until the read ends'''
+
+
+    def __init__(self, reads, file_name):
+
+        # Raises OSError if the file can't be found
+        super().__init__(reads)
+        self.file_size = max(os.path.getsize(file_name), 1)
+        self.result = None
+
+
+    def watch(self, widget, poll_ms, show, finished, error_prefix = 'Error: '):
+        '''Starts the read, passing show the progress text every poll_ms from
+        widget.after, and then calling finished(result, message) once it ends,
+        where the result is None and the message says why if it wasn't read'''
+        self.start()
+        widget.after(poll_ms, self._poll, widget, poll_ms, show, finished, error_prefix)
+        return self
+
+
+    def _poll(self, widget, poll_ms, show, finished, error_prefix):
+        read = None
+        for read, result in self.poll():
+            if result is not None:
+                self.result = result
+        if not self.finished:
+            if read is not None:
+                show(f'Reading file... {min(read / self.file_size, 1):.0%} ({read / 2 ** 20:,.0f} of {self.file_size / 2 ** 20:,.0f} MB)')
+            widget.after(poll_ms, self._poll, widget, poll_ms, show, finished, error_prefix)
+            return
+
+        if self.result is not None:
+            finished(self.result, None)
+        elif self.cancelled.is_set():
+            finished(None, 'Import cancelled')
+        elif isinstance(self.error, ValueError):
+            finished(None, f'{error_prefix}{self.error}')
+        else:
+            finished(None, f'{error_prefix}File could not be read')